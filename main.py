@@ -1,48 +1,1721 @@
 from astrbot.api.all import *
 from astrbot.api.event.filter import command
+from astrbot.api.event import MessageChain
+from astrbot.api import AstrBotConfig
 import json
+import asyncio
+import threading
+from functools import partial, wraps
+from urllib.parse import quote, unquote
 from astrbot.api.message_components import At
 import os
+import time
+import hashlib
+import gzip
+import re
 import logging
 import random
+import heapq
+import bisect
+from collections import OrderedDict, deque
+from datetime import date
+import sqlite3
 from typing import Dict, List, Any
 
+try:
+    import numpy as np
+except ImportError:  # numpy 为可选依赖，未安装时全部走纯 Python 路径
+    np = None
+
 logger = logging.getLogger("MahjongPlugin")
 
 # 数据存储路径
 DATA_DIR = os.path.join("data", "plugins", "astrbot_mahjong_plugin")
 os.makedirs(DATA_DIR, exist_ok=True)
-DATA_FILE = os.path.join(DATA_DIR, "mahjong_data.json")
 EVENT_DATA_FILE = os.path.join(DATA_DIR, "event_data.json")
+# 每个群一个分片：groups/<ctx_id>.json 为快照，groups/<ctx_id>.journal.jsonl 为增量日志
+# 每次结算/罚分只追加受影响的条目，累计到一定条数后再压缩成该群的快照
+GROUPS_DIR = os.path.join(DATA_DIR, "groups")
+os.makedirs(GROUPS_DIR, exist_ok=True)
+SNAPSHOT_SUFFIX = ".json"
+JOURNAL_SUFFIX = ".journal.jsonl"
+JOURNAL_COMPACT_EVERY = 500
+# 每群的对局记录 groups/<ctx_id>.matches.jsonl：每场结算/罚分/进入决赛/重置各一条，只追加不压缩
+# 选手的累计数据是这些记录的汇总结果，结算时增量更新，不必从记录重算；
+# 开始记录之前已有的累计数据在第一条记录处存为一条基线 (baseline)，重算从基线起算
+MATCHES_SUFFIX = ".matches.jsonl"
+# 罚分备注写入对局记录时的最大长度
+CHOMBO_REASON_MAX = 100
+# 快照格式：首行为文件头 (版本号、已包含的日志序号、正文校验和)，第二行为正文
+SNAPSHOT_SCHEMA = 2
+# 往届赛季归档 archive/<ctx_id>/season_<n>.json.gz：/新赛季 时把选手数据和本赛季对局记录压缩存入，
+# 热数据只保留当前赛季；查询往届时才按需读取
+ARCHIVE_DIR = os.path.join(DATA_DIR, "archive")
+ARCHIVE_PATTERN = re.compile(r"season_(\d+)\.json\.gz$")
+# 内存中最多保留的已解压归档数
+ARCHIVE_CACHE_SIZE = 4
+# 每群的生涯汇总 archive/<ctx_id>/career.json：每届赛季归档时累加一次，查询生涯不必读取各届归档
+CAREER_FILE = "career.json"
+# 旧版单文件存储，启动时自动迁移到分片
+DATA_FILE = os.path.join(DATA_DIR, "mahjong_data.json")
+JOURNAL_FILE = os.path.join(DATA_DIR, "mahjong_journal.jsonl")
+DB_FILE = os.path.join(DATA_DIR, "mahjong_data.db")
+# 进行中对局桌的日志 (开桌/加入/报分/取消/结算)，重启后重放恢复；条数过多时压缩为当前桌况
+TABLES_FILE = os.path.join(DATA_DIR, "tables.journal.jsonl")
+TABLES_COMPACT_EVERY = 200
+# 检查超时对局的间隔 (秒)；超时时长见配置 recruit_ttl_minutes / playing_ttl_minutes
+EXPIRE_CHECK_INTERVAL = 60
+# 整文件保存的合并窗口 (秒)：窗口内的多次保存只序列化、写盘一次
+SAVE_DELAY = 0.5
+
+
+class PlayerStats:
+    """
+    选手赛季数据
+    用 __slots__ 代替每人一个字符串键的 dict，内存占用小得多；to_dict / from_dict 与原有 JSON 结构一一对应
+    """
+
+    __slots__ = (
+        "name", "total_pt", "total_matches", "ranks", "max_score", "total_score",
+        "avoid_4_rate", "is_finalist", "regular_raw_pt", "regular_ranking_pt",
+    )
+
+    def __init__(self, name: str, total_pt: float = 0.0, total_matches: int = 0, ranks: list = None,
+                 max_score: int = 0, total_score: int = 0, avoid_4_rate: float = 0.0,
+                 is_finalist: bool = False, regular_raw_pt: float = None, regular_ranking_pt: float = None):
+        self.name = name
+        self.total_pt = total_pt
+        self.total_matches = total_matches
+        self.ranks = ranks if ranks is not None else [0, 0, 0, 0]  # [1位数, 2位数, 3位数, 4位数]
+        self.max_score = max_score
+        self.total_score = total_score
+        self.avoid_4_rate = avoid_4_rate
+        self.is_finalist = is_finalist
+        self.regular_raw_pt = regular_raw_pt          # 进入决赛前的原始分
+        self.regular_ranking_pt = regular_ranking_pt  # 进入决赛前罚分后的排位分
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "PlayerStats":
+        return cls(
+            d.get("name", ""), d.get("total_pt", 0.0), d.get("total_matches", 0), list(d.get("ranks", [0, 0, 0, 0])),
+            d.get("max_score", 0), d.get("total_score", 0), d.get("avoid_4_rate", 0.0),  # 旧数据可能没有 total_score
+            d.get("is_finalist", False), d.get("regular_raw_pt"), d.get("regular_ranking_pt"),
+        )
+
+    def to_dict(self) -> dict:
+        d = {
+            "name": self.name, "total_pt": self.total_pt, "total_matches": self.total_matches,
+            "ranks": self.ranks, "max_score": self.max_score, "total_score": self.total_score,
+            "avoid_4_rate": self.avoid_4_rate,
+        }
+        if self.is_finalist:
+            d["is_finalist"] = True
+        if self.regular_raw_pt is not None:
+            d["regular_raw_pt"] = self.regular_raw_pt
+        if self.regular_ranking_pt is not None:
+            d["regular_ranking_pt"] = self.regular_ranking_pt
+        return d
+
+    def record_game(self, name: str, slot: int, score: int, pt: float):
+        """计入一场对局，slot 为顺位下标 (同分并列时取并列中最高的顺位)"""
+        self.name = name
+        self.total_pt = round(self.total_pt + pt, 1)
+        self.total_matches += 1
+        self.ranks[slot] += 1
+        self.total_score += score
+        if score > self.max_score:
+            self.max_score = score
+        self.avoid_4_rate = round((sum(self.ranks[:3]) / self.total_matches) * 100, 2)
+
+    def undo_game(self, slot: int, score: int, pt: float) -> bool:
+        """
+        撤销一场已计入的对局 (record_game 的逆操作)
+        返回 True 表示撤销的得点正是最高得点，需要由调用方按对局记录重新求最高得点
+        """
+        self.total_pt = round(self.total_pt - pt, 1)
+        self.total_matches -= 1
+        self.ranks[slot] -= 1
+        self.total_score -= score
+        self.avoid_4_rate = round((sum(self.ranks[:3]) / self.total_matches) * 100, 2) if self.total_matches else 0.0
+        return score >= self.max_score
+
+    def enter_finals(self) -> tuple:
+        """
+        进入决赛：备份常规赛成绩 (评奖用)，决赛初始分 = 排位分 / 4
+        返回 (原始分, 缺席罚分, 排位分, 决赛初始分)
+        """
+        raw_pt = self.total_pt
+        penalty = _ranking_penalty(self.total_matches)
+        ranking_pt = raw_pt - penalty
+        self.regular_raw_pt = raw_pt          # 原始分
+        self.regular_ranking_pt = ranking_pt  # 罚分后的排位分
+        self.total_pt = round(ranking_pt / 4, 1)
+        self.is_finalist = True
+        return raw_pt, penalty, ranking_pt, self.total_pt
+
+
+class EventPlayerStats:
+    """活动场选手数据 (仅素点，无顺位马)"""
+
+    __slots__ = ("name", "total_pt", "total_matches", "total_score", "ng_count")
+
+    def __init__(self, name: str, total_pt: float = 0.0, total_matches: int = 0, total_score: int = 0, ng_count: int = 0):
+        self.name = name
+        self.total_pt = total_pt
+        self.total_matches = total_matches
+        self.total_score = total_score
+        self.ng_count = ng_count
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "EventPlayerStats":
+        return cls(d.get("name", ""), d.get("total_pt", 0.0), d.get("total_matches", 0),
+                   d.get("total_score", 0), d.get("ng_count", 0))  # 旧数据可能没有 ng_count
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name, "total_pt": self.total_pt, "total_matches": self.total_matches,
+            "total_score": self.total_score, "ng_count": self.ng_count,
+        }
+
+    def record_game(self, name: str, score: int, pt: float):
+        self.name = name
+        self.total_pt = round(self.total_pt + pt, 1)
+        self.total_matches += 1
+        self.total_score += score
+
+
+class CareerStats:
+    """选手跨赛季的生涯汇总，每届赛季结束时累加一次"""
+
+    __slots__ = ("name", "seasons", "total_pt", "total_matches", "ranks", "total_score", "max_score", "finals")
+
+    def __init__(self, name: str, seasons: int = 0, total_pt: float = 0.0, total_matches: int = 0,
+                 ranks: list = None, total_score: int = 0, max_score: int = 0, finals: int = 0):
+        self.name = name
+        self.seasons = seasons
+        self.total_pt = total_pt
+        self.total_matches = total_matches
+        self.ranks = ranks if ranks is not None else [0, 0, 0, 0]
+        self.total_score = total_score
+        self.max_score = max_score
+        self.finals = finals  # 进入决赛的届数
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "CareerStats":
+        return cls(
+            d.get("name", ""), d.get("seasons", 0), d.get("total_pt", 0.0), d.get("total_matches", 0),
+            list(d.get("ranks", [0, 0, 0, 0])), d.get("total_score", 0), d.get("max_score", 0), d.get("finals", 0),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name, "seasons": self.seasons, "total_pt": self.total_pt,
+            "total_matches": self.total_matches, "ranks": self.ranks, "total_score": self.total_score,
+            "max_score": self.max_score, "finals": self.finals,
+        }
+
+    def add_season(self, user: "PlayerStats"):
+        """计入一届赛季的最终数据"""
+        self.name = user.name
+        self.seasons += 1
+        self.total_pt = round(self.total_pt + _season_pt(user), 1)
+        self.total_matches += user.total_matches
+        self.ranks = [a + b for a, b in zip(self.ranks, user.ranks)]
+        self.total_score += user.total_score
+        self.max_score = max(self.max_score, user.max_score)
+        if user.is_finalist:
+            self.finals += 1
+
+
+def _to_json(obj):
+    """json.dumps 的 default 钩子：把选手数据对象转回原有的 dict 结构"""
+    if isinstance(obj, (PlayerStats, EventPlayerStats, CareerStats)):
+        return obj.to_dict()
+    raise TypeError(f"无法序列化 {type(obj).__name__}")
+
+
+def _group_from_json(raw: dict) -> dict:
+    """把 JSON 中的群数据转成 uid -> PlayerStats (is_playoffs 等群级字段原样保留)"""
+    return {k: PlayerStats.from_dict(v) if isinstance(v, dict) else v for k, v in raw.items()}
+
+
+def _encode_snapshot(data: dict, seq: int) -> str:
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_to_json)
+    header = {"schema": SNAPSHOT_SCHEMA, "seq": seq, "sha256": hashlib.sha256(body.encode("utf-8")).hexdigest()}
+    return json.dumps(header) + "\n" + body + "\n"
+
+
+def _decode_snapshot(text: str) -> tuple:
+    """校验并解析快照，返回 (数据, 已包含的日志序号)；校验失败抛出 ValueError"""
+    header_line, _, body = text.partition("\n")
+    try:
+        header = json.loads(header_line)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or "sha256" not in header:
+        # 没有文件头的旧格式快照
+        return json.loads(text), 0
+    if header.get("schema", 0) > SNAPSHOT_SCHEMA:
+        raise ValueError(f"不支持的快照版本 {header.get('schema')}")
+    body = body.rstrip("\n")
+    if hashlib.sha256(body.encode("utf-8")).hexdigest() != header["sha256"]:
+        raise ValueError("快照校验和不匹配")
+    return json.loads(body), header.get("seq", 0)
+
+
+def _ranking_penalty(matches: int) -> int:
+    """排位罚分：不足 20 场时每缺 1 场罚 50pt"""
+    return max(0, 20 - matches) * 50
+
+
+def _ranking_pt(data: PlayerStats) -> float:
+    """排位PT = 原始PT - 缺席罚分"""
+    return data.total_pt - _ranking_penalty(data.total_matches)
+
+
+def _season_pt(data: PlayerStats) -> float:
+    """
+    本赛季对局实际得到的 PT 合计
+    决赛选手的 total_pt 已换算成决赛初始分，需要换回常规赛原始分再加上决赛中的得失
+    """
+    if data.regular_raw_pt is None or data.regular_ranking_pt is None:
+        return data.total_pt
+    return round(data.regular_raw_pt + data.total_pt - round(data.regular_ranking_pt / 4, 1), 1)
+
+
+# 顺位马点 (1~4 位)
+UMA_SLOTS = [50.0, 10.0, -10.0, -30.0]
+
+
+def _settle_scores(scores: list) -> list:
+    """
+    按从高到低排好的四家得点计算每家的 (顺位下标, 马点, 最终PT)
+    同分者平分所占顺位的马点，顺位计为并列中最高的一位；结算与重算共用这一规则
+    """
+    result = []
+    i = 0
+    while i < len(scores):
+        j = i + 1
+        while j < len(scores) and scores[j] == scores[i]:
+            j += 1
+        avg_uma = sum(UMA_SLOTS[i:j]) / (j - i)
+        for k in range(i, j):
+            result.append((i, avg_uma, round((scores[k] - 30000) / 1000.0 + avg_uma, 1)))
+        i = j
+    return result
+
+
+def _game_results(record: dict) -> list:
+    """
+    按当前规则重新结算一条对局记录，返回按名次排列的 [(uid, 名字, 得点, 顺位下标, PT)]
+    不用记录里存的 slots/pt：调整规则并重算后，撤销、修正和各项统计都要与累计数据用同一套规则
+    """
+    order = sorted(range(len(record["scores"])), key=lambda k: record["scores"][k], reverse=True)
+    scores = [record["scores"][k] for k in order]
+    return [
+        (record["uids"][k], record["names"][k], score, slot, pt)
+        for k, score, (slot, _, pt) in zip(order, scores, _settle_scores(scores))
+    ]
+
+
+# 排行榜排序键 (按键升序即榜单从高到低)，与 SqliteStore.ORDERS 一一对应
+BOARD_KEYS = {
+    "pt": lambda d: -d.total_pt,
+    "ranking": lambda d: -_ranking_pt(d),
+    "first": lambda d: (-d.ranks[0], d.total_matches),
+    "max_score": lambda d: -d.max_score,
+    "avoid_4": lambda d: -d.avoid_4_rate,
+}
+# BOARD_KEYS 的向量化版本：输入整群的列数组，返回排序键列 (多列时按优先级从高到低)
+BOARD_ARRAY_KEYS = {
+    "pt": lambda c: (-c["total_pt"],),
+    "ranking": lambda c: (-c["ranking_pt"],),
+    "first": lambda c: (-c["ranks"][:, 0], c["total_matches"]),
+    "max_score": lambda c: (-c["max_score"],),
+    "avoid_4": lambda c: (-c["avoid_4_rate"],),
+}
+# 上榜所需的最少场数
+BOARD_MIN_MATCHES = {"avoid_4": 5}
+# 一个群的人数达到该值且装有 numpy 时，整群建榜改用数组运算
+NUMPY_MIN_PLAYERS = 1000
+# 重算时一段对局记录达到该条数且装有 numpy 时，整批计算
+NUMPY_MIN_RECORDS = 1000
+# 排行榜每页显示的人数
+RANK_PAGE_SIZE = 20
+# 排行榜分块有序表每块的目标条数 (块超过两倍时对半分裂)
+BOARD_BLOCK_SIZE = 512
+# 渲染缓存最多保留的消息条数
+RENDER_CACHE_SIZE = 256
+# 时间段榜单按天分桶，最多保留最近这么多天
+WINDOW_DAYS = 30
+# /rank pt week|month 的时间段参数 -> 统计最近几天 (含今天)
+RANK_WINDOWS = {"week": 7, "周": 7, "本周": 7, "month": 30, "月": 30, "本月": 30}
+# 个人面板 "近期状态" 统计的最近场数，环形缓冲区长度取其中最大值
+FORM_WINDOWS = (10, 20, 50)
+
+
+def _player_columns(players: list) -> dict:
+    """把一群选手的数据转成列数组 (需要 numpy)，排位PT 整列计算"""
+    n = len(players)
+    total_pt = np.fromiter((p.total_pt for p in players), dtype=np.float64, count=n)
+    matches = np.fromiter((p.total_matches for p in players), dtype=np.int64, count=n)
+    return {
+        "total_pt": total_pt,
+        "total_matches": matches,
+        "ranks": np.array([p.ranks for p in players], dtype=np.int64).reshape(n, 4),
+        "max_score": np.fromiter((p.max_score for p in players), dtype=np.int64, count=n),
+        "avoid_4_rate": np.fromiter((p.avoid_4_rate for p in players), dtype=np.float64, count=n),
+        "ranking_pt": total_pt - np.maximum(0, 20 - matches) * 50,
+    }
+
+
+def _effective_records(records: list) -> list:
+    """
+    按撤销 (void) / 修正 (fix) 记录折算后的记录序列
+    被撤销的对局去掉，被修正的对局换成最后一次修正的结果，仍留在原来的位置
+    """
+    latest = {r["target"]: r for r in records if r["type"] in ("void", "fix")}
+    result = []
+    for record in records:
+        if record["type"] in ("void", "fix"):
+            continue
+        change = latest.get(record["id"])
+        if change is None:
+            result.append(record)
+        elif change["type"] == "fix":
+            result.append({**change, "id": record["id"], "ts": record["ts"], "type": "game"})
+    return result
+
+
+def _match_state(records: list, match_id: int) -> tuple:
+    """
+    在本赛季的记录中查找对局 #match_id 当前生效的结果
+    返回 (对局结果, None)；不能撤销或修正时返回 (None, 原因)
+    """
+    game = None
+    for record in records:
+        if record["id"] == match_id:
+            if record["type"] != "game":
+                return None, f"记录 #{match_id} 不是对局结算记录"
+            game = record
+        elif game is None:
+            continue
+        elif record.get("target") == match_id:
+            if record["type"] == "void":
+                return None, f"对局 #{match_id} 已经撤销过了"
+            game = record
+        elif record["type"] == "finals":
+            # 进入决赛时按当时的 PT 换算了决赛初始分，之前的对局不能再单独改动
+            return None, f"对局 #{match_id} 之后已进入决赛，无法再撤销或修正"
+    if game is None:
+        return None, f"找不到本赛季的对局记录 #{match_id}"
+    return game, None
+
+
+def _max_scores(records: list, uids) -> dict:
+    """按折算后的对局记录求指定选手本赛季的最高得点"""
+    best = {uid: 0 for uid in uids}
+    for record in _effective_records(records):
+        if record["type"] == "baseline":
+            for uid, d in record["players"].items():
+                if uid in best and d.get("max_score", 0) > best[uid]:
+                    best[uid] = d["max_score"]
+        elif record["type"] == "game":
+            for uid, score in zip(record["uids"], record["scores"]):
+                if uid in best and score > best[uid]:
+                    best[uid] = score
+    return best
+
+
+def _history_counts(records: list) -> dict:
+    """
+    按折算后的对局记录统计每位选手的对局场数 (只有罚分或进入决赛记录的选手记 0 场)
+    基线中的选手按基线里的场数计；累计场数多于这里的选手说明有更早的数据不在记录里 (没有基线的旧版记录)
+    """
+    counts = {}
+    for record in _effective_records(records):
+        if record["type"] == "baseline":
+            for uid, d in record["players"].items():
+                counts[uid] = counts.get(uid, 0) + d.get("total_matches", 0)
+        elif record["type"] == "game":
+            for uid in record["uids"]:
+                counts[uid] = counts.get(uid, 0) + 1
+        elif record["type"] == "chombo":
+            counts.setdefault(record["uid"], 0)
+        elif record["type"] == "finals":
+            for uid in record["uids"]:
+                counts.setdefault(uid, 0)
+    return counts
+
+
+def _replay_records(records: list) -> dict:
+    """
+    由本赛季的对局记录 (按编号排好) 重新算出一个群的赛季数据
+    对局按 _settle_scores 重新计算马点和 PT，不依赖记录里保存的结果，规则调整后重算即可生效；
+    进入决赛会改写选手的 PT，以此为界把记录分段，每段整批累加
+    """
+    ctx_data = {}
+    segment = []
+    for record in _effective_records(records):
+        if record["type"] == "baseline":
+            # 基线只会是本赛季的第一条记录
+            ctx_data = _group_from_json(record["players"])
+            if record.get("is_playoffs"):
+                ctx_data["is_playoffs"] = True
+        elif record["type"] in ("game", "chombo"):
+            segment.append(record)
+        elif record["type"] == "finals":
+            _apply_records(ctx_data, segment)
+            segment = []
+            for uid in record["uids"]:
+                user = ctx_data.get(uid)
+                if user is None:
+                    user = ctx_data[uid] = PlayerStats(f"选手{uid}")
+                user.enter_finals()
+            ctx_data["is_playoffs"] = True
+    _apply_records(ctx_data, segment)
+    return ctx_data
+
+
+def _apply_records(ctx_data: dict, records: list):
+    """把一段对局/罚分记录计入 ctx_data，与逐场结算的结果一致"""
+    if np is not None and len(records) >= NUMPY_MIN_RECORDS:
+        _apply_records_arrays(ctx_data, records)
+        return
+    for record in records:
+        if record["type"] == "chombo":
+            user = ctx_data.get(record["uid"])
+            if user is None:
+                user = ctx_data[record["uid"]] = PlayerStats(record["name"])
+            user.total_pt = round(user.total_pt + record["pt"], 1)
+            continue
+        for uid, name, score, slot, pt in _game_results(record):
+            user = ctx_data.get(uid)
+            if user is None:
+                user = ctx_data[uid] = PlayerStats(name)
+            user.record_game(name, slot, score, pt)
+
+
+def _apply_records_arrays(ctx_data: dict, records: list):
+    """
+    _apply_records 的向量化版本 (需要 numpy)
+    各场得点排成 (场数, 4) 的数组一次算出顺位与马点，再用 bincount 按选手累加；
+    PT 的取整仍用 Python 的 round (只对不同取值各算一次)，保证与逐场结算逐位相同
+    """
+    index = {}
+    games = [r for r in records if r["type"] == "game"]
+    chombos = [r for r in records if r["type"] == "chombo"]
+    for r in games:
+        for uid in r["uids"]:
+            index.setdefault(uid, len(index))
+    for r in chombos:
+        index.setdefault(r["uid"], len(index))
+    n = len(index)
+
+    scores = np.array([r["scores"] for r in games], dtype=np.int64).reshape(-1, 4)
+    uids = np.array([[index[uid] for uid in r["uids"]] for r in games], dtype=np.int64).reshape(-1, 4)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    scores = np.take_along_axis(scores, order, axis=1)
+    uids = np.take_along_axis(uids, order, axis=1)
+    # 同分者在排好序的行里相邻：顺位取并列中的第一个位置，马点取并列位置的平均
+    tied = scores[:, :, None] == scores[:, None, :]
+    slots = tied.argmax(axis=2)
+    uma = (tied * np.array(UMA_SLOTS)).sum(axis=2) / tied.sum(axis=2)
+    raw, inverse = np.unique((scores - 30000) / 1000.0 + uma, return_inverse=True)
+    pt = np.array([round(v, 1) for v in raw.tolist()])[inverse.reshape(-1)]
+
+    flat_uids = uids.reshape(-1)
+    flat_scores = scores.reshape(-1)
+    pt_sum = np.bincount(flat_uids, weights=pt, minlength=n).astype(np.float64)
+    if chombos:
+        pt_sum += np.bincount([index[r["uid"]] for r in chombos], weights=[r["pt"] for r in chombos], minlength=n)
+    matches = np.bincount(flat_uids, minlength=n)
+    score_sum = np.bincount(flat_uids, weights=flat_scores, minlength=n)
+    ranks = np.bincount(flat_uids * 4 + slots.reshape(-1), minlength=n * 4).reshape(n, 4)
+    max_score = np.zeros(n, dtype=np.int64)
+    np.maximum.at(max_score, flat_uids, flat_scores)
+
+    # 名字取该选手最后一场对局时的名字
+    names = {}
+    for r in games:
+        for uid, name in zip(r["uids"], r["names"]):
+            names[uid] = name
+    for r in chombos:
+        names.setdefault(r["uid"], r["name"])
+
+    for uid, i in index.items():
+        user = ctx_data.get(uid)
+        if user is None:
+            user = ctx_data[uid] = PlayerStats(names[uid])
+        user.total_pt = round(user.total_pt + pt_sum[i].item(), 1)
+        played = matches[i].item()
+        if not played:
+            continue
+        user.name = names[uid]
+        user.total_matches += played
+        user.ranks = [a + b for a, b in zip(user.ranks, ranks[i].tolist())]
+        user.total_score += int(score_sum[i])
+        user.max_score = max(user.max_score, max_score[i].item())
+        user.avoid_4_rate = round((sum(user.ranks[:3]) / user.total_matches) * 100, 2)
+
+
+class RenderCache:
+    """
+    已渲染消息的 LRU 缓存
+    键里带有群数据版本号，数据一变动旧版本的键就不会再被命中，随后按 LRU 淘汰
+    """
+
+    def __init__(self, maxsize: int = RENDER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    def get(self, key):
+        text = self.items.get(key)
+        if text is not None:
+            self.items.move_to_end(key)
+        return text
+
+    def put(self, key, text: str):
+        self.items[key] = text
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+
+def _day_of(ts: float) -> int:
+    """时间戳所在的自然日 (本地时间) 序号"""
+    return date.fromtimestamp(ts).toordinal()
+
+
+class WindowBuckets:
+    """
+    一个群按天分桶的 PT 汇总，供时间段榜单使用
+    每个桶是当天各选手的 [名字, PT, 场数]；只保留最近 WINDOW_DAYS 天，更早的桶在新的一天开桶时淘汰
+    查询最近 N 天只需合并至多 N 个桶，不必翻对局记录
+    """
+
+    __slots__ = ("days",)
+
+    def __init__(self):
+        # deque[(日序号, {uid: [名字, PT, 场数]})]，按日期递增
+        self.days = deque()
+
+    def add(self, record: dict):
+        """计入一条对局 (game) 或罚分 (chombo) 记录，其余类型忽略"""
+        if record["type"] == "game":
+            # 按当前规则重新结算，与重算后的累计数据一致
+            entries = [(uid, name, pt, 1) for uid, name, _, _, pt in _game_results(record)]
+        elif record["type"] == "chombo":
+            entries = [(record["uid"], record["name"], record["pt"], 0)]
+        else:
+            return
+        day = _day_of(record["ts"])
+        if not self.days or self.days[-1][0] < day:
+            self.days.append((day, {}))
+            while self.days[0][0] <= day - WINDOW_DAYS:
+                self.days.popleft()
+        # 记录按编号顺序到达，日期不会倒退；系统时钟被回拨时计入最近的桶
+        bucket = self.days[-1][1]
+        for uid, name, pt, games in entries:
+            row = bucket.get(uid)
+            if row is None:
+                bucket[uid] = [name, pt, games]
+            else:
+                row[0] = name
+                row[1] += pt
+                row[2] += games
+
+    def top(self, days: int, today: int) -> list:
+        """最近 days 天 (含 today) 的 [(uid, 名字, PT, 场数)]，按 PT 从高到低"""
+        totals = {}
+        for day, bucket in reversed(self.days):
+            if day <= today - days:
+                break
+            if day > today:
+                continue
+            for uid, (name, pt, games) in bucket.items():
+                row = totals.get(uid)
+                if row is None:
+                    totals[uid] = [name, pt, games]
+                else:
+                    row[1] += pt
+                    row[2] += games
+        rows = [(uid, name, round(pt, 1), games) for uid, (name, pt, games) in totals.items()]
+        rows.sort(key=lambda r: -r[2])
+        return rows
+
+
+class RecentForm:
+    """
+    单个选手最近 max(FORM_WINDOWS) 场的环形缓冲区 (顺位、得点、PT)
+    对每个统计窗口维护滚动合计：新一场写入时加上它、减去刚好滑出该窗口的那一场，读写都是 O(1)
+    """
+
+    __slots__ = ("slots", "scores", "pts", "head", "count", "sums")
+
+    SIZE = max(FORM_WINDOWS)
+
+    def __init__(self):
+        self.slots = [0] * self.SIZE
+        self.scores = [0] * self.SIZE
+        self.pts = [0.0] * self.SIZE
+        # 下一场写入的位置与已记录的场数 (最多 SIZE)
+        self.head = 0
+        self.count = 0
+        # 每个窗口的 [顺位合计, 得点合计, PT合计]
+        self.sums = [[0, 0, 0.0] for _ in FORM_WINDOWS]
+
+    def push(self, slot: int, score: int, pt: float):
+        for n, sums in zip(FORM_WINDOWS, self.sums):
+            if self.count >= n:
+                old = (self.head - n) % self.SIZE
+                sums[0] -= self.slots[old]
+                sums[1] -= self.scores[old]
+                sums[2] -= self.pts[old]
+            sums[0] += slot
+            sums[1] += score
+            sums[2] += pt
+        self.slots[self.head] = slot
+        self.scores[self.head] = score
+        self.pts[self.head] = pt
+        self.head = (self.head + 1) % self.SIZE
+        self.count = min(self.count + 1, self.SIZE)
+
+    def window(self, i: int) -> tuple:
+        """第 i 个窗口的 (场数, 平均顺位, 平均得点, PT合计)；场数不足时按已有场数计算"""
+        games = min(FORM_WINDOWS[i], self.count)
+        slot_sum, score_sum, pt_sum = self.sums[i]
+        return games, slot_sum / games + 1, int(score_sum / games), round(pt_sum, 1)
+
+
+class SortedBoard:
+    """
+    单个榜单：按排序键升序排列的 (key, uid)，配合 uid -> key 反查表做增量更新
+    条目存成分块有序表 (每块至多 2 * BOARD_BLOCK_SIZE 条)：先二分定位块、再在块内二分，
+    插入/删除只移动一块之内的元素，不会随全群人数线性变慢；各块长度记在树状数组里，求名次与翻页定位都是 O(log n)
+    """
+
+    def __init__(self, key_func):
+        self.key_func = key_func
+        self.blocks = []  # [[(key, uid), ...], ...]，块内与块间都按升序
+        self.maxes = []   # 每块的最后一条，用于定位块
+        self.tree = [0]   # 块长度的树状数组 (下标从 1 开始)
+        self.size = 0
+        self.keys = {}
+
+    def build(self, users):
+        """从 [(uid, data)] 批量建榜"""
+        self.keys = {uid: self.key_func(data) for uid, data in users}
+        self._reset(sorted((key, uid) for uid, key in self.keys.items()))
+
+    def load(self, uids: list, keys: list, order: list):
+        """直接装入已按 (key, uid) 排好的结果，order 为 uids / keys 的下标序列"""
+        sorted_keys = list(map(keys.__getitem__, order))
+        sorted_uids = list(map(uids.__getitem__, order))
+        self._reset(list(zip(sorted_keys, sorted_uids)))
+        self.keys = dict(zip(sorted_uids, sorted_keys))
+
+    def _reset(self, entries: list):
+        self.blocks = [entries[i:i + BOARD_BLOCK_SIZE] for i in range(0, len(entries), BOARD_BLOCK_SIZE)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(entries)
+        self._build_tree()
+
+    def _build_tree(self):
+        """按当前各块长度重建树状数组 (只在整体装入和块分裂/删空时调用)"""
+        n = len(self.blocks)
+        tree = [0] * (n + 1)
+        for i, block in enumerate(self.blocks, 1):
+            tree[i] += len(block)
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def _tree_add(self, i: int, delta: int):
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, i: int) -> int:
+        """前 i 块的条目总数"""
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def _find(self, index: int) -> tuple:
+        """第 index 条 (从 0 起) 所在的 (块下标, 块内下标)"""
+        pos, rest = 0, index
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self.tree) and self.tree[nxt] <= rest:
+                pos = nxt
+                rest -= self.tree[nxt]
+            step >>= 1
+        return pos, rest
+
+    def update(self, uid: str, data: PlayerStats):
+        self.discard(uid)
+        key = self.keys[uid] = self.key_func(data)
+        self._insert((key, uid))
+
+    def discard(self, uid: str):
+        key = self.keys.pop(uid, None)
+        if key is not None:
+            self._remove((key, uid))
+
+    def _insert(self, entry: tuple):
+        if not self.blocks:
+            self._reset([entry])
+            return
+        i = min(bisect.bisect_left(self.maxes, entry), len(self.blocks) - 1)
+        block = self.blocks[i]
+        bisect.insort(block, entry)
+        self.maxes[i] = block[-1]
+        self.size += 1
+        if len(block) > 2 * BOARD_BLOCK_SIZE:
+            half = len(block) // 2
+            self.blocks[i:i + 1] = [block[:half], block[half:]]
+            self.maxes[i:i + 1] = [block[half - 1], block[-1]]
+            self._build_tree()
+        else:
+            self._tree_add(i, 1)
+
+    def _remove(self, entry: tuple):
+        i = bisect.bisect_left(self.maxes, entry)
+        block = self.blocks[i]
+        del block[bisect.bisect_left(block, entry)]
+        self.size -= 1
+        if block:
+            self.maxes[i] = block[-1]
+            self._tree_add(i, -1)
+        else:
+            del self.blocks[i]
+            del self.maxes[i]
+            self._build_tree()
+
+    def uids(self, start: int = 0, stop: int = None) -> list:
+        stop = self.size if stop is None else min(stop, self.size)
+        result = []
+        if start >= stop:
+            return result
+        i, offset = self._find(start)
+        while len(result) < stop - start:
+            chunk = self.blocks[i][offset:offset + stop - start - len(result)]
+            result.extend(uid for _, uid in chunk)
+            i, offset = i + 1, 0
+        return result
+
+    def position(self, uid: str):
+        """名次 = 排序键严格更优的人数 + 1 (同分同名次)，二分查找 O(log n)"""
+        key = self.keys.get(uid)
+        if key is None:
+            return "N/A"
+        i = bisect.bisect_left(self.maxes, (key,))
+        return self._prefix(i) + bisect.bisect_left(self.blocks[i], (key,)) + 1
+
+    def __len__(self):
+        return self.size
+
+
+class Leaderboards:
+    """一个群的全部排行榜 (JSON 后端使用；SQLite 后端直接走索引查询)"""
+
+    def __init__(self, ctx_data: dict):
+        users = [(uid, data) for uid, data in ctx_data.items() if isinstance(data, PlayerStats)]
+        self.boards = {name: SortedBoard(key_func) for name, key_func in BOARD_KEYS.items()}
+        if np is not None and len(users) >= NUMPY_MIN_PLAYERS:
+            self._build_arrays(users)
+            return
+        for name, board in self.boards.items():
+            min_matches = BOARD_MIN_MATCHES.get(name, 0)
+            board.build([(uid, data) for uid, data in users if data.total_matches >= min_matches])
+
+    def _build_arrays(self, users: list):
+        """
+        向量化建榜：排序键整列算出后用稳定的 lexsort 排序
+        事先按 uid 排好，同键者保持 uid 升序，结果与 (key, uid) 元组排序完全一致，之后的增量更新照常二分
+        """
+        users.sort(key=lambda item: item[0])
+        uids = [uid for uid, _ in users]
+        cols = _player_columns([data for _, data in users])
+        for name, board in self.boards.items():
+            key_cols = BOARD_ARRAY_KEYS[name](cols)
+            keys = key_cols[0].tolist() if len(key_cols) == 1 else list(zip(*(c.tolist() for c in key_cols)))
+            order = np.lexsort(key_cols[::-1])
+            min_matches = BOARD_MIN_MATCHES.get(name, 0)
+            if min_matches:
+                order = order[cols["total_matches"][order] >= min_matches]
+            board.load(uids, keys, order.tolist())
+
+    def update(self, uid: str, data: PlayerStats):
+        """选手数据变动后，只把这一名选手移出并重新插入各榜"""
+        for name, board in self.boards.items():
+            if data.total_matches >= BOARD_MIN_MATCHES.get(name, 0):
+                board.update(uid, data)
+            else:
+                board.discard(uid)
+
+
+class DiskWriter:
+    """
+    后台写盘线程
+    命令处理只把写盘任务交给它，open/write 在线程里完成，不阻塞事件循环。
+    带 key 的任务 (整文件覆盖写) 在队列里只保留最新一个；不带 key 的任务 (日志追加) 按顺序全部执行。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queue = []  # [(key, fn)]
+        self._busy = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="mahjong-disk-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, key: str = None):
+        with self._cond:
+            if key is not None:
+                self._queue = [job for job in self._queue if job[0] != key]
+            self._queue.append((key, fn))
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                jobs, self._queue = self._queue, []
+                self._busy = True
+            for _, fn in jobs:
+                try:
+                    fn()
+                except Exception as e:
+                    logger.error(f"后台写盘失败: {e}")
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """阻塞直到队列中已提交的任务全部写完"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+
+class TableIndex:
+    """
+    运行时对局桌的辅助索引 (常规场、活动场各一份)
+    seats: (ctx_id, uid) -> 桌号，查找选手所在的桌不再需要遍历全部对局
+    high / free: 每群已用到的最大桌号与已释放桌号的最小堆，分配时总是给出最小的空闲桌号
+    recruiting: 每群正在招募的桌 (按开桌顺序的有序集合)，自动加入时不必遍历全部对局
+    所有移除桌子的操作都经过 remove/clear，保证索引与 matches 同步
+    """
+
+    def __init__(self, matches: dict):
+        self.matches = matches
+        self.seats = {}
+        self.high = {}
+        self.free = {}
+        self.recruiting = {}
+
+    def allocate(self, ctx_id: str) -> str:
+        """分配最小的空闲桌号 (1, 2, 3...)"""
+        free = self.free.get(ctx_id)
+        if free:
+            return str(heapq.heappop(free))
+        self.high[ctx_id] = self.high.get(ctx_id, 0) + 1
+        return str(self.high[ctx_id])
+
+    def find(self, ctx_id: str, uid: str):
+        mid = self.seats.get((ctx_id, uid))
+        if mid is None:
+            return None, None
+        return mid, self.matches[ctx_id][mid]
+
+    def seat(self, ctx_id: str, uid: str, mid: str):
+        self.seats[(ctx_id, uid)] = mid
+
+    def recruit(self, ctx_id: str, mid: str):
+        self.recruiting.setdefault(ctx_id, {})[mid] = None
+
+    def start(self, ctx_id: str, mid: str):
+        """桌子人满开打，移出招募集合"""
+        tables = self.recruiting.get(ctx_id)
+        if tables is not None:
+            tables.pop(mid, None)
+            if not tables:
+                del self.recruiting[ctx_id]
+
+    def recruiting_tables(self, ctx_id: str) -> list:
+        return list(self.recruiting.get(ctx_id, ()))
+
+    def remove(self, ctx_id: str, mid: str) -> dict:
+        """移除一张桌，释放桌上选手并维护外层字典整洁"""
+        match = self.matches[ctx_id].pop(mid)
+        for uid in match["players"]:
+            self.seats.pop((ctx_id, uid), None)
+        self.start(ctx_id, mid)
+        if not self.matches[ctx_id]:
+            # 全部桌子都关闭后桌号从 1 重新开始
+            del self.matches[ctx_id]
+            self.high.pop(ctx_id, None)
+            self.free.pop(ctx_id, None)
+        else:
+            heapq.heappush(self.free.setdefault(ctx_id, []), int(mid))
+        return match
+
+    def clear(self, ctx_id: str):
+        for mid in list(self.matches.get(ctx_id, {})):
+            self.remove(ctx_id, mid)
+
+    def rebuild(self):
+        """按 matches 的现有内容重建全部索引 (重启恢复对局桌后调用)"""
+        self.seats, self.high, self.free, self.recruiting = {}, {}, {}, {}
+        for ctx_id, tables in self.matches.items():
+            mids = sorted(tables, key=int)
+            for mid in mids:
+                for uid in tables[mid]["players"]:
+                    self.seats[(ctx_id, uid)] = mid
+                if tables[mid]["status"] == "recruiting":
+                    self.recruit(ctx_id, mid)
+            self.high[ctx_id] = int(mids[-1])
+            used = set(map(int, mids))
+            self.free[ctx_id] = [n for n in range(1, self.high[ctx_id]) if n not in used]
+
+
+class SqliteStore:
+    """
+    可选的 SQLite 存储后端 (WAL 模式)
+    players 表存选手赛季数据，groups 表存群组状态，matches 表存对局记录；排行榜直接走索引 ORDER BY/LIMIT，
+    群组数据在首次用到时才按 ctx_id 加载，启动时不再解析全部数据。
+    """
+
+    ORDERS = {
+        "pt": "total_pt DESC",
+        "ranking": "total_pt - MAX(0, 20 - total_matches) * 50 DESC",
+        "first": "rank1 DESC, total_matches ASC",
+        "max_score": "max_score DESC",
+        "avoid_4": "avoid_4_rate DESC",
+    }
+    # 计算名次时比较的表达式，须与 ORDERS 及索引保持一致
+    POSITION_EXPRS = {
+        "pt": "total_pt",
+        "ranking": "total_pt - MAX(0, 20 - total_matches) * 50",
+    }
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS players (
+            ctx_id TEXT NOT NULL,
+            uid TEXT NOT NULL,
+            name TEXT NOT NULL,
+            total_pt REAL NOT NULL DEFAULT 0,
+            total_matches INTEGER NOT NULL DEFAULT 0,
+            rank1 INTEGER NOT NULL DEFAULT 0,
+            rank2 INTEGER NOT NULL DEFAULT 0,
+            rank3 INTEGER NOT NULL DEFAULT 0,
+            rank4 INTEGER NOT NULL DEFAULT 0,
+            max_score INTEGER NOT NULL DEFAULT 0,
+            total_score INTEGER NOT NULL DEFAULT 0,
+            avoid_4_rate REAL NOT NULL DEFAULT 0,
+            is_finalist INTEGER NOT NULL DEFAULT 0,
+            regular_raw_pt REAL,
+            regular_ranking_pt REAL,
+            PRIMARY KEY (ctx_id, uid)
+        );
+        CREATE TABLE IF NOT EXISTS groups (
+            ctx_id TEXT PRIMARY KEY,
+            is_playoffs INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS matches (
+            ctx_id TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            ts REAL NOT NULL,
+            type TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (ctx_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_players_pt ON players (ctx_id, total_pt);
+        CREATE INDEX IF NOT EXISTS idx_players_ranking
+            ON players (ctx_id, (total_pt - MAX(0, 20 - total_matches) * 50));
+        CREATE INDEX IF NOT EXISTS idx_players_first ON players (ctx_id, rank1, total_matches DESC);
+        CREATE INDEX IF NOT EXISTS idx_players_max_score ON players (ctx_id, max_score);
+        CREATE INDEX IF NOT EXISTS idx_players_avoid_4 ON players (ctx_id, avoid_4_rate);
+    """
+    COLUMNS = (
+        "uid, name, total_pt, total_matches, rank1, rank2, rank3, rank4, "
+        "max_score, total_score, avoid_4_rate, is_finalist, regular_raw_pt, regular_ranking_pt"
+    )
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def is_new(self) -> bool:
+        """库是否尚未完成初始化 (用 user_version 标记，只导入一次旧数据)"""
+        return self.conn.execute("PRAGMA user_version").fetchone()[0] == 0
+
+    @staticmethod
+    def _row_to_user(row) -> tuple:
+        return row[0], PlayerStats(
+            row[1], row[2], row[3], [row[4], row[5], row[6], row[7]], row[8], row[9], row[10],
+            bool(row[11]), row[12], row[13],
+        )
+
+    def load_group(self, ctx_id: str) -> dict:
+        ctx_data = {}
+        rows = self.conn.execute(f"SELECT {self.COLUMNS} FROM players WHERE ctx_id = ?", (ctx_id,))
+        for row in rows:
+            uid, user = self._row_to_user(row)
+            ctx_data[uid] = user
+        group = self.conn.execute("SELECT is_playoffs FROM groups WHERE ctx_id = ?", (ctx_id,)).fetchone()
+        if group and group[0]:
+            ctx_data["is_playoffs"] = True
+        return ctx_data
+
+    def write(self, ctx_id: str, entries: dict, record: dict = None):
+        """写入一组变更条目 (uid -> PlayerStats，或群组级的 is_playoffs)，以及产生这些变更的对局记录"""
+        with self.conn:
+            if record is not None:
+                self._insert_record(ctx_id, record)
+            self._write_entries(ctx_id, entries)
+
+    def _write_entries(self, ctx_id: str, entries: dict):
+        for key, value in entries.items():
+            if key == "is_playoffs":
+                self.conn.execute(
+                    "INSERT INTO groups (ctx_id, is_playoffs) VALUES (?, ?) "
+                    "ON CONFLICT(ctx_id) DO UPDATE SET is_playoffs = excluded.is_playoffs",
+                    (ctx_id, int(bool(value))),
+                )
+                continue
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO players (ctx_id, {self.COLUMNS}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    ctx_id, key, value.name, value.total_pt, value.total_matches, *value.ranks,
+                    value.max_score, value.total_score, value.avoid_4_rate, int(value.is_finalist),
+                    value.regular_raw_pt, value.regular_ranking_pt,
+                ),
+            )
+
+    def reset(self, ctx_id: str, record: dict = None):
+        """清空该群赛季数据；上赛季的对局记录已归档，只保留这条重置记录 (编号接着往下排)"""
+        with self.conn:
+            if record is not None:
+                self.conn.execute("DELETE FROM matches WHERE ctx_id = ? AND id < ?", (ctx_id, record["id"]))
+                self._insert_record(ctx_id, record)
+            self.conn.execute("DELETE FROM players WHERE ctx_id = ?", (ctx_id,))
+            self.conn.execute("DELETE FROM groups WHERE ctx_id = ?", (ctx_id,))
+
+    def _insert_record(self, ctx_id: str, record: dict):
+        self.conn.execute(
+            "INSERT INTO matches (ctx_id, id, ts, type, data) VALUES (?, ?, ?, ?, ?)",
+            (ctx_id, record["id"], record["ts"], record["type"],
+             json.dumps(record, ensure_ascii=False, separators=(",", ":"))),
+        )
+
+    def replace_group(self, ctx_id: str, ctx_data: dict):
+        """用重算结果整体替换一个群的赛季数据 (对局记录不变)"""
+        with self.conn:
+            self.conn.execute("DELETE FROM players WHERE ctx_id = ?", (ctx_id,))
+            self.conn.execute("DELETE FROM groups WHERE ctx_id = ?", (ctx_id,))
+            self._write_entries(ctx_id, ctx_data)
+
+    def season_records(self, ctx_id: str) -> list:
+        """本赛季 (最后一次重置之后) 的全部对局记录，按编号排列"""
+        rows = self.conn.execute(
+            "SELECT data FROM matches WHERE ctx_id = ? AND id > "
+            "(SELECT COALESCE(MAX(id), 0) FROM matches WHERE ctx_id = ? AND type = 'reset') ORDER BY id",
+            (ctx_id, ctx_id),
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def last_match_id(self, ctx_id: str) -> int:
+        return self.conn.execute("SELECT MAX(id) FROM matches WHERE ctx_id = ?", (ctx_id,)).fetchone()[0] or 0
+
+    def import_data(self, data: dict, records: dict = None):
+        """
+        从旧版 JSON 数据一次性导入，并标记库已初始化
+        records: ctx_id -> 该群的对局记录，原样导入，编号和重算都接着原来的记录往下走
+        """
+        for ctx_id, ctx_data in data.items():
+            if isinstance(ctx_data, dict):
+                self.write(ctx_id, ctx_data)
+        with self.conn:
+            for ctx_id, group_records in (records or {}).items():
+                # 崩溃重启可能留下重复编号的行，以先写入的为准
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO matches (ctx_id, id, ts, type, data) VALUES (?, ?, ?, ?, ?)",
+                    [(ctx_id, r["id"], r["ts"], r["type"], json.dumps(r, ensure_ascii=False, separators=(",", ":")))
+                     for r in group_records],
+                )
+        self.conn.execute("PRAGMA user_version = 1")
+
+    def top(self, ctx_id: str, board: str, limit: int = -1, offset: int = 0) -> list:
+        rows = self.conn.execute(
+            f"SELECT {self.COLUMNS} FROM players WHERE ctx_id = ? AND total_matches >= ? "
+            f"ORDER BY {self.ORDERS[board]} LIMIT ? OFFSET ?",
+            (ctx_id, BOARD_MIN_MATCHES.get(board, 0), limit, offset),
+        )
+        return [self._row_to_user(row) for row in rows]
+
+    def count(self, ctx_id: str, board: str) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM players WHERE ctx_id = ? AND total_matches >= ?",
+            (ctx_id, BOARD_MIN_MATCHES.get(board, 0)),
+        ).fetchone()[0]
+
+    def position(self, ctx_id: str, uid: str, board: str):
+        """返回选手在榜单上的名次 (比他高的人数 + 1)"""
+        expr = self.POSITION_EXPRS[board]
+        row = self.conn.execute(
+            f"SELECT {expr} FROM players WHERE ctx_id = ? AND uid = ?", (ctx_id, uid)
+        ).fetchone()
+        if row is None:
+            return "N/A"
+        higher = self.conn.execute(
+            f"SELECT COUNT(*) FROM players WHERE ctx_id = ? AND {expr} > ?", (ctx_id, row[0])
+        ).fetchone()[0]
+        return higher + 1
+
+    def close(self):
+        self.conn.close()
+
+def _group_serialized(handler):
+    """
+    同一群内串行执行的命令：整个处理过程 (包括中途发出消息时的让出) 都持有该群的锁
+    结算前会先发一条提示再继续，不加锁时同桌另一人的提交可能插进来导致重复结算；
+    锁按群区分，不同群的命令仍然并发执行
+    """
+    @wraps(handler)
+    async def wrapper(self, event, *args, **kwargs):
+        async with self._group_lock(self._get_context_id(event)):
+            async for item in handler(self, event, *args, **kwargs):
+                yield item
+    return wrapper
 
 @register("N_league", "Vege", "日麻对局记录插件", "2.0.0")
 class MahjongPlugin(Star):
-    def __init__(self, context: Context):
+    def __init__(self, context: Context, config: AstrBotConfig = None):
         super().__init__(context)
+        self.config = config or {}
+        # 各群增量日志的条数 (用于触发压缩) 与最新日志序号
+        self._journal_counts = {}
+        self._seqs = {}
+        # 写盘交给后台线程；记录待整文件保存的群组和活动数据
+        self._writer = DiskWriter()
+        self._dirty_groups = set()
+        self._event_dirty = False
+        self._flush_handle = None
+        # 可选 SQLite 后端；默认使用 JSON 快照 + 增量日志
+        self.sql = SqliteStore(DB_FILE) if self.config.get("storage_backend", "json") == "sqlite" else None
         self.data = self._load_data()
+        # 各群的增量排行榜，首次查询时建立 (仅 JSON 后端)
+        self.boards = {}
+        # 各群按天分桶的时间段榜单与各选手的近期状态，首次查询时由本赛季对局记录建立
+        self._windows = {}
+        self._forms = {}
+        # 已加载的往届赛季归档 (只读，LRU) 与各群的生涯汇总
+        self._archives = OrderedDict()
+        self._careers = {}
+        # 各群最后一条对局记录的编号，首次用到时从记录文件/数据库中读出
+        self._match_ids = {}
+        # 各群数据版本号 (每次变动 +1) 与按版本缓存的渲染结果；活动场单独计数
+        self._versions = {}
+        self._event_versions = {}
+        self._render_cache = RenderCache()
         # 运行时缓存，用于存储当前正在进行的对局状态
-        # 结构: { ctx_id: { "players": {uid: name}, "scores": {uid: score}, "status": "waiting/playing" } }
+        # 结构: { ctx_id: { 桌号: { "players": {uid: name}, "scores": {uid: score}, "status": "recruiting/playing",
+        #                          "origin": 开桌的会话 (超时通知用), "updated": 最后变动时间 } } }
         self.active_matches = {}
         # --- 活动场独立变量 ---
         self.event_data = self._load_event_data()
         self.event_matches = {} # 结构同 active_matches，专供活动场
+        self.active_index = TableIndex(self.active_matches)
+        self.event_index = TableIndex(self.event_matches)
+        # 对局桌超时期限的最小堆 [(期限, kind, ctx_id, 桌号, 该桌最后变动时间)]；桌子再有变动时压入新期限，旧条目出堆时作废
+        self._deadlines = []
+        self._expiry_task = None
+        self._table_log_count = self._load_tables()
+        self._start_expiry_task()
+        # 各群的对局锁 (开桌/加入/结算/取消串行执行)，首次使用时创建
+        self._locks = {}
 
     def _load_data(self) -> dict:
-        if not os.path.exists(DATA_FILE):
-            return {}
+        """启动时只做迁移，不加载任何群组；群数据在首次访问时才读入"""
+        self._migrate_legacy_data()
+        if self.sql and self.sql.is_new():
+            # 首次启用 SQLite 时把已有的 JSON 分片和对局记录导入库中
+            records = {}
+            for filename in os.listdir(GROUPS_DIR):
+                if filename.endswith(MATCHES_SUFFIX):
+                    ctx_id = unquote(filename[:-len(MATCHES_SUFFIX)])
+                    records[ctx_id] = list(self._read_journal(self._group_path(ctx_id, MATCHES_SUFFIX)))
+            self.sql.import_data(
+                {ctx_id: self._load_group_file(ctx_id) for ctx_id in self._list_group_files()}, records
+            )
+        return {}
+
+    @staticmethod
+    def _group_path(ctx_id: str, suffix: str) -> str:
+        return os.path.join(GROUPS_DIR, quote(ctx_id, safe="") + suffix)
+
+    @staticmethod
+    def _list_group_files() -> set:
+        ctx_ids = set()
+        for filename in os.listdir(GROUPS_DIR):
+            for suffix in (JOURNAL_SUFFIX, SNAPSHOT_SUFFIX):
+                if filename.endswith(suffix):
+                    ctx_ids.add(unquote(filename[:-len(suffix)]))
+                    break
+        return ctx_ids
+
+    def _migrate_legacy_data(self):
+        """把旧版的单文件数据 (mahjong_data.json + 全局日志) 拆分成每群一个分片"""
+        if not os.path.exists(DATA_FILE) and not os.path.exists(JOURNAL_FILE):
+            return
+        data = {}
+        if os.path.exists(DATA_FILE):
+            try:
+                with open(DATA_FILE, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception as e:
+                logger.error(f"加载旧版数据失败，放弃迁移: {e}")
+                return
+        for entry in self._read_journal(JOURNAL_FILE):
+            self._apply_journal_entry(data.setdefault(entry["ctx"], {}), entry)
+
+        for ctx_id, ctx_data in data.items():
+            self._write_file(self._group_path(ctx_id, SNAPSHOT_SUFFIX), _encode_snapshot(ctx_data, 0))
+        for path in (DATA_FILE, JOURNAL_FILE):
+            if os.path.exists(path):
+                os.replace(path, path + ".migrated")
+        logger.info(f"已将 {len(data)} 个群组的数据迁移为分片存储")
+
+    def _load_group_file(self, ctx_id: str) -> dict:
+        """
+        读取单个群的快照并重放其增量日志
+        快照损坏时回退到上一份快照 (.bak)，再依次重放轮转出的旧日志与当前日志补齐
+        """
+        ctx_data, seq = {}, 0
+        snapshot = self._group_path(ctx_id, SNAPSHOT_SUFFIX)
+        for path in (snapshot, snapshot + ".bak"):
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    raw, seq = _decode_snapshot(f.read())
+                ctx_data = _group_from_json(raw)
+                if path != snapshot:
+                    logger.warning(f"{ctx_id} 的快照损坏，已回退到上一份快照")
+                break
+            except Exception as e:
+                logger.error(f"快照校验失败 ({path}): {e}")
+        else:
+            if os.path.exists(snapshot):
+                # 没有可用快照时把损坏文件挪开保留，避免下次压缩直接覆盖
+                os.replace(snapshot, f"{snapshot}.corrupt-{int(time.time())}")
+
+        journal = self._group_path(ctx_id, JOURNAL_SUFFIX)
+        count = 0
+        for path in (journal + ".1", journal):
+            for entry in self._read_journal(path):
+                # 序号不大于快照序号的条目已包含在快照中
+                if entry.get("seq", seq + 1) <= seq:
+                    continue
+                self._apply_journal_entry(ctx_data, entry)
+                seq = entry.get("seq", seq)
+                count += 1
+        self._journal_counts[ctx_id] = count
+        self._seqs[ctx_id] = seq
+        return ctx_data
+
+    @staticmethod
+    def _read_journal(path: str):
+        """逐条读取增量日志"""
+        if not os.path.exists(path):
+            return
         try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # 写入中途崩溃只会弄坏最后一行，跳过即可
+                        logger.warning(f"增量日志存在损坏行，已跳过: {path}")
         except Exception as e:
-            logger.error(f"加载数据失败: {e}")
-            return {}
+            logger.error(f"读取增量日志失败: {e}")
+
+    @staticmethod
+    def _apply_journal_entry(ctx_data: dict, entry: dict):
+        if entry["op"] == "reset":
+            ctx_data.clear()
+            return
+        ctx_data.update(_group_from_json(entry.get("set", {})))
+
+    def _save_data(self, ctx_id: str):
+        """请求该群的一次全量快照 (日志压缩)，实际写盘在后台合并进行"""
+        self._journal_counts[ctx_id] = 0
+        self._dirty_groups.add(ctx_id)
+        self._schedule_flush()
 
-    def _save_data(self):
+    def _schedule_flush(self):
+        """合并窗口内的多次保存只序列化一次"""
+        if self._flush_handle is not None:
+            return
         try:
-            with open(DATA_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"保存数据失败: {e}")
+            self._flush_handle = asyncio.get_running_loop().call_later(SAVE_DELAY, self._flush_dirty)
+        except RuntimeError:
+            # 不在事件循环中 (如初始化阶段)，直接提交
+            self._flush_dirty()
+
+    def _flush_dirty(self):
+        """只序列化有改动的群组/活动数据，交给后台线程写盘"""
+        self._flush_handle = None
+        dirty, self._dirty_groups = self._dirty_groups, set()
+        for ctx_id in dirty:
+            text = _encode_snapshot(self.data.get(ctx_id, {}), self._seqs.get(ctx_id, 0))
+            self._writer.submit(partial(self._write_snapshot, ctx_id, text), key=f"group:{ctx_id}")
+        if self._event_dirty:
+            self._event_dirty = False
+            text = json.dumps(self.event_data, ensure_ascii=False, indent=2, default=_to_json)
+            self._writer.submit(partial(self._write_file, EVENT_DATA_FILE, text), key="event")
+
+    @staticmethod
+    def _write_file(path: str, text: str):
+        """原子写入：先写临时文件并 fsync，再 rename 覆盖，崩溃时不会留下半截文件"""
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _write_snapshot(self, ctx_id: str, text: str):
+        """
+        [后台线程] 写入群快照并轮转其增量日志
+        旧快照保留为 .bak，旧日志保留为 .1，两者合起来就是上一份完好的状态
+        """
+        snapshot = self._group_path(ctx_id, SNAPSHOT_SUFFIX)
+        tmp = snapshot + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(snapshot):
+            os.replace(snapshot, snapshot + ".bak")
+        os.replace(tmp, snapshot)
+        journal = self._group_path(ctx_id, JOURNAL_SUFFIX)
+        if os.path.exists(journal):
+            os.replace(journal, journal + ".1")
+
+    @staticmethod
+    def _append_line(path: str, line: str):
+        """[后台线程] 追加一行增量日志"""
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def _table_sets(self) -> dict:
+        return {"active": self.active_matches, "event": self.event_matches}
+
+    def _load_tables(self) -> int:
+        """重放对局桌日志，恢复重启前进行中的对局；返回日志条数"""
+        count = 0
+        sets = self._table_sets()
+        for entry in self._read_journal(TABLES_FILE):
+            count += 1
+            tables = sets[entry["kind"]]
+            ctx_id, mid = entry["ctx"], entry.get("mid")
+            if "table" in entry:
+                tables.setdefault(ctx_id, {})[mid] = entry["table"]
+            elif mid is None:
+                tables.pop(ctx_id, None)
+            elif mid in tables.get(ctx_id, {}):
+                del tables[ctx_id][mid]
+                if not tables[ctx_id]:
+                    del tables[ctx_id]
+        self.active_index.rebuild()
+        self.event_index.rebuild()
+        for kind, tables in sets.items():
+            for ctx_id, group in tables.items():
+                for mid, table in group.items():
+                    self._schedule_expiry(kind, ctx_id, mid, table)
+        restored = sum(len(t) for t in self.active_matches.values()) + sum(len(t) for t in self.event_matches.values())
+        if restored:
+            logger.info(f"已恢复 {restored} 张进行中的对局桌")
+        return count
+
+    def _log_table(self, kind: str, op: str, ctx_id: str, mid: str = None):
+        """
+        记录一次桌况变动 (kind: active / event)，并按变动时间刷新该桌的超时期限
+        开桌、加入、报分写入该桌变动后的完整状态，取消、结算写入移除标记，不带桌号表示清空全群；
+        序列化在事件循环里完成 (一张桌只有几个字段)，落盘交给后台线程，不拖慢命令响应
+        """
+        entry = {"kind": kind, "op": op, "ctx": ctx_id}
+        if mid is not None:
+            entry["mid"] = mid
+            table = self._table_sets()[kind].get(ctx_id, {}).get(mid)
+            if table is not None:
+                table["updated"] = time.time()
+                entry["table"] = table
+                self._schedule_expiry(kind, ctx_id, mid, table)
+        if self._expiry_task is None:
+            self._start_expiry_task()
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        self._writer.submit(partial(self._append_line, TABLES_FILE, line))
+        self._table_log_count += 1
+        if self._table_log_count >= TABLES_COMPACT_EVERY:
+            self._compact_tables()
+
+    def _table_ttl(self, status: str) -> float:
+        """该状态的桌子闲置多少秒后超时，0 表示不超时"""
+        key = "recruit_ttl_minutes" if status == "recruiting" else "playing_ttl_minutes"
+        default = 30 if status == "recruiting" else 180
+        return max(0, self.config.get(key, default)) * 60
+
+    def _schedule_expiry(self, kind: str, ctx_id: str, mid: str, table: dict):
+        ttl = self._table_ttl(table["status"])
+        if ttl:
+            updated = table.setdefault("updated", time.time())
+            heapq.heappush(self._deadlines, (updated + ttl, kind, ctx_id, mid, updated))
+
+    def _start_expiry_task(self):
+        try:
+            self._expiry_task = asyncio.get_running_loop().create_task(self._expiry_loop())
+        except RuntimeError:
+            # 不在事件循环中 (如初始化阶段)，首次有对局变动时再启动
+            self._expiry_task = None
+
+    async def _expiry_loop(self):
+        """后台定时关闭超时的对局桌；每次只弹出已到期的堆顶，不扫描全部对局"""
+        while True:
+            await asyncio.sleep(EXPIRE_CHECK_INTERVAL)
+            try:
+                await self._expire_tables(time.time())
+            except Exception as e:
+                logger.error(f"清理超时对局失败: {e}")
+
+    async def _expire_tables(self, now: float):
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, kind, ctx_id, mid, updated = heapq.heappop(self._deadlines)
+            async with self._group_lock(ctx_id):
+                # 桌子已被结算/取消，或之后又有变动 (已压入更晚的期限)，这一条作废
+                table = self._table_sets()[kind].get(ctx_id, {}).get(mid)
+                if table is None or table.get("updated") != updated:
+                    continue
+                index = self.active_index if kind == "active" else self.event_index
+                index.remove(ctx_id, mid)
+                self._log_table(kind, "expire", ctx_id, mid)
+
+            minutes = int(self._table_ttl(table["status"]) // 60)
+            label = "对局" if kind == "active" else "活动局"
+            names = "、".join(table["players"].values())
+            if table["status"] == "recruiting":
+                text = f"⌛ {label} #{mid} 超过 {minutes} 分钟未凑齐 4 人，已自动关闭招募。\n已释放: {names}"
+            else:
+                text = f"⌛ {label} #{mid} 超过 {minutes} 分钟未完成报分，已自动中止，本局数据不记录。\n已释放: {names}"
+            origin = table.get("origin")
+            if origin:
+                try:
+                    await self.context.send_message(origin, MessageChain().message(text))
+                except Exception as e:
+                    logger.warning(f"发送对局超时通知失败: {e}")
+
+    def _compact_tables(self):
+        """把对局桌日志整体替换为当前每张桌一条的状态"""
+        lines = []
+        for kind, tables in self._table_sets().items():
+            for ctx_id, group in tables.items():
+                for mid, table in group.items():
+                    entry = {"kind": kind, "op": "open", "ctx": ctx_id, "mid": mid, "table": table}
+                    lines.append(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._writer.submit(partial(self._write_file, TABLES_FILE, "".join(lines)), key="tables")
+        self._table_log_count = len(lines)
+
+    def _record_change(self, ctx_id: str, op: str, keys=(), record: dict = None) -> dict:
+        """
+        追加一条变更日志，只写入受影响的条目
+        op: settle (对局结算) / chombo (罚分) / finals (进入决赛) / reset (重置赛季) / void (撤销结算) / fix (修正结算)
+            / baseline (开始记录前的累计数据)
+        record: 产生这次变更的对局记录，分配编号和时间后写入该群的对局记录，返回写入的记录
+        """
+        if record is not None:
+            record = {"id": self._next_match_id(ctx_id), "ts": round(time.time(), 3), **record}
+        ctx_data = self.data.get(ctx_id, {})
+        changes = {k: ctx_data[k] for k in keys if k in ctx_data}
+        self._versions[ctx_id] = self._versions.get(ctx_id, 0) + 1
+        boards = self.boards.get(ctx_id)
+        if boards is not None:
+            if op == "reset":
+                del self.boards[ctx_id]
+            else:
+                for uid, data in changes.items():
+                    if isinstance(data, PlayerStats):
+                        boards.update(uid, data)
+        windows = self._windows.get(ctx_id)
+        if windows is not None:
+            if op in ("reset", "void", "fix"):
+                # 撤销/修正要改动过去的桶，直接作废，下次查询时按记录重建
+                del self._windows[ctx_id]
+            elif record is not None:
+                windows.add(record)
+        forms = self._forms.get(ctx_id)
+        if forms is not None:
+            if op in ("reset", "void", "fix"):
+                del self._forms[ctx_id]
+            elif record is not None and record["type"] == "game":
+                self._push_form(forms, record)
+
+        if self.sql:
+            if op == "reset":
+                self.sql.reset(ctx_id, record)
+            else:
+                self.sql.write(ctx_id, changes, record)
+            return record
+
+        if record is not None:
+            # 先写对局记录再写累计数据的日志，两者不一致时以对局记录为准
+            line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+            self._writer.submit(partial(self._append_line, self._group_path(ctx_id, MATCHES_SUFFIX), line))
+
+        seq = self._seqs[ctx_id] = self._seqs.get(ctx_id, 0) + 1
+        entry = {"op": op, "seq": seq}
+        if op != "reset":
+            entry["set"] = changes
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=_to_json) + "\n"
+        self._writer.submit(partial(self._append_line, self._group_path(ctx_id, JOURNAL_SUFFIX), line))
+
+        count = self._journal_counts[ctx_id] = self._journal_counts.get(ctx_id, 0) + 1
+        if count >= JOURNAL_COMPACT_EVERY:
+            self._save_data(ctx_id)
+        return record
+
+    def _last_match_id(self, ctx_id: str) -> int:
+        last = self._match_ids.get(ctx_id)
+        if last is None:
+            last = self._match_ids[ctx_id] = self.sql.last_match_id(ctx_id) if self.sql else self._last_history_id(ctx_id)
+        return last
+
+    def _next_match_id(self, ctx_id: str) -> int:
+        """分配该群下一条对局记录的编号 (从 1 递增，重置赛季后继续累加)"""
+        last = self._match_ids[ctx_id] = self._last_match_id(ctx_id) + 1
+        return last
+
+    def _read_season_records(self, ctx_id: str) -> list:
+        """[后台线程] 读出该群本赛季 (最后一次重置之后) 的全部对局记录"""
+        records = []
+        for record in self._read_journal(self._group_path(ctx_id, MATCHES_SUFFIX)):
+            if record.get("type") == "reset":
+                records = []
+            else:
+                records.append(record)
+        return records
+
+    def _last_history_id(self, ctx_id: str) -> int:
+        """从对局记录文件末尾往前按块读，读出最后一条完整记录的编号，不必读完整个文件"""
+        path = self._group_path(ctx_id, MATCHES_SUFFIX)
+        if not os.path.exists(path):
+            return 0
+        with open(path, "rb") as f:
+            pos = f.seek(0, os.SEEK_END)
+            partial_line = b""
+            while pos > 0:
+                step = min(4096, pos)
+                pos -= step
+                f.seek(pos)
+                lines = (f.read(step) + partial_line).split(b"\n")
+                # 块首的一段可能只是半行，未读到文件开头时留给下一块拼完整
+                partial_line = lines.pop(0) if pos > 0 else b""
+                for line in reversed(lines):
+                    try:
+                        return json.loads(line)["id"]
+                    except (ValueError, KeyError, TypeError):
+                        # 空行或写入中途崩溃的末行
+                        continue
+        return 0
+
+    def _get_ctx_data(self, ctx_id: str, create: bool = False) -> dict:
+        """取群组赛季数据；首次访问时才从分片文件或数据库中加载该群"""
+        if ctx_id not in self.data:
+            ctx_data = self.data[ctx_id] = self.sql.load_group(ctx_id) if self.sql else self._load_group_file(ctx_id)
+            if ctx_data and self._last_match_id(ctx_id) == 0:
+                # 已有累计数据却还没有任何对局记录 (开始记录之前的数据)：先记下基线，重算时从这里起算
+                players = {uid: user.to_dict() for uid, user in ctx_data.items() if isinstance(user, PlayerStats)}
+                self._record_change(ctx_id, "baseline", record={
+                    "type": "baseline", "players": players, "is_playoffs": bool(ctx_data.get("is_playoffs")),
+                })
+        if create:
+            return self.data.setdefault(ctx_id, {})
+        return self.data.get(ctx_id, {})
+
+    def _get_boards(self, ctx_id: str) -> Leaderboards:
+        boards = self.boards.get(ctx_id)
+        if boards is None:
+            boards = self.boards[ctx_id] = Leaderboards(self._get_ctx_data(ctx_id))
+        return boards
+
+    def _sorted_users(self, ctx_id: str, board: str, start: int = 0, stop: int = None) -> tuple:
+        """按榜单从高到低取第 start ~ stop 名，返回 ([(uid, data), ...], 上榜总人数)"""
+        if self.sql:
+            limit = -1 if stop is None else stop - start
+            return self.sql.top(ctx_id, board, limit, start), self.sql.count(ctx_id, board)
+        ctx_data = self._get_ctx_data(ctx_id)
+        sorted_board = self._get_boards(ctx_id).boards[board]
+        return [(uid, ctx_data[uid]) for uid in sorted_board.uids(start, stop)], len(sorted_board)
+
+    @staticmethod
+    def _parse_page(option: str) -> tuple:
+        """
+        解析榜单翻页参数: 数字为页码，top=N 为只看前 N 名
+        返回 (起始下标, 结束下标, 页码)，top=N 时页码为 None
+        """
+        option = str(option).strip().lower()
+        if option.startswith("top="):
+            n = int(option[4:]) if option[4:].isdigit() else RANK_PAGE_SIZE
+            return 0, max(n, 1), None
+        page = int(option) if option.isdigit() and int(option) > 0 else 1
+        return (page - 1) * RANK_PAGE_SIZE, page * RANK_PAGE_SIZE, page
+
+    @staticmethod
+    def _page_footer(page, total: int, next_cmd: str) -> list:
+        """多页时追加页码提示"""
+        pages = max(1, -(-total // RANK_PAGE_SIZE))
+        if page is None or pages <= 1:
+            return []
+        footer = f"—— 第 {page}/{pages} 页 (共 {total} 人)"
+        if page < pages:
+            footer += f"，发送 {next_cmd} {page + 1} 查看下一页"
+        return [footer + " ——"]
+
+    def _user_position(self, ctx_id: str, uid: str, board: str):
+        """查询选手在榜单上的名次"""
+        if self.sql:
+            return self.sql.position(ctx_id, uid, board)
+        return self._get_boards(ctx_id).boards[board].position(uid)
+
+    @staticmethod
+    def _get_player(ctx_data: dict, uid: str, name: str) -> PlayerStats:
+        """取选手数据，不存在时以默认值建档"""
+        user = ctx_data.get(uid)
+        if user is None:
+            user = ctx_data[uid] = PlayerStats(name)
+        return user
 
     def _get_context_id(self, event: AstrMessageEvent) -> str:
         """获取上下文ID（群组ID或私聊ID）"""
@@ -52,14 +1725,15 @@ class MahjongPlugin(Star):
             return f"private_{event.user_id}"
         return "default_ctx"
         
+    def _group_lock(self, ctx_id: str) -> asyncio.Lock:
+        lock = self._locks.get(ctx_id)
+        if lock is None:
+            lock = self._locks[ctx_id] = asyncio.Lock()
+        return lock
+
     def _get_user_match(self, ctx_id: str, user_id: str):
         """查找指定用户当前所在的对局ID及对局数据"""
-        if ctx_id not in self.active_matches:
-            return None, None
-        for mid, match in self.active_matches[ctx_id].items():
-            if user_id in match["players"]:
-                return mid, match
-        return None, None
+        return self.active_index.find(ctx_id, user_id)
 
     def _calculate_pt_custom(self, score: int, rank: int) -> float:
         """
@@ -75,6 +1749,7 @@ class MahjongPlugin(Star):
         return round((score - 30000) / 1000.0 + final_uma[rank], 1)
 
     @command("mj_start", alias=["对局开始", "开房"])
+    @_group_serialized
     async def start_match(self, event: AstrMessageEvent):
         """开始一场新的对局，自动分配桌号"""
         ctx_id = self._get_context_id(event)
@@ -90,18 +1765,19 @@ class MahjongPlugin(Star):
         if ctx_id not in self.active_matches:
             self.active_matches[ctx_id] = {}
             
-        # 寻找空闲桌号 (1, 2, 3...)
-        match_id = 1
-        while str(match_id) in self.active_matches[ctx_id]:
-            match_id += 1
-        match_id = str(match_id)
+        # 分配空闲桌号 (1, 2, 3...)
+        match_id = self.active_index.allocate(ctx_id)
 
         # 创建并自动加入
         self.active_matches[ctx_id][match_id] = {
             "players": {user_id: user_name},
             "scores": {},
-            "status": "recruiting"
+            "status": "recruiting",
+            "origin": event.unified_msg_origin,
         }
+        self.active_index.seat(ctx_id, user_id, match_id)
+        self.active_index.recruit(ctx_id, match_id)
+        self._log_table("active", "create", ctx_id, match_id)
         
         yield event.plain_result(
             f"对局 #{match_id} 已建立！\n"
@@ -112,12 +1788,13 @@ class MahjongPlugin(Star):
         )
 
     @command("mj_join", alias=["加入对局", "join"])
+    @_group_serialized
     async def join_match(self, event: AstrMessageEvent, match_id: str = ""):
         """加入当前招募中的对局"""
         ctx_id = self._get_context_id(event)
         user_id = event.get_sender_id()
         user_name = event.get_sender_name()
-        ctx_data = self.data.get(ctx_id, {})
+        ctx_data = self._get_ctx_data(ctx_id)
         match_id = str(match_id).strip()
 
         # 检查是否已经在对局中
@@ -133,7 +1810,7 @@ class MahjongPlugin(Star):
         # 决赛圈锁
         if ctx_data.get("is_playoffs", False):
             user_data = ctx_data.get(user_id)
-            if not user_data or not user_data.get("is_finalist"):
+            if not user_data or not user_data.is_finalist:
                 yield event.plain_result(f"🔒 决赛进行中！{user_name} 不是决赛选手，无法加入。")
                 return
 
@@ -149,14 +1826,15 @@ class MahjongPlugin(Star):
                 yield event.plain_result(f"⚠️ 找不到对局 #{match_id}。")
                 return
         else:
-            recruiting_matches = {k: v for k, v in self.active_matches[ctx_id].items() if v["status"] == "recruiting"}
-            if not recruiting_matches:
+            recruiting_mids = self.active_index.recruiting_tables(ctx_id)
+            if not recruiting_mids:
                 yield event.plain_result("QAQ 当前所有的对局都已经人满开始了……")
                 return
-            elif len(recruiting_matches) == 1:
-                target_mid, target_match = list(recruiting_matches.items())[0]
+            elif len(recruiting_mids) == 1:
+                target_mid = recruiting_mids[0]
+                target_match = self.active_matches[ctx_id][target_mid]
             else:
-                match_list = ", ".join([f"#{k}" for k in recruiting_matches.keys()])
+                match_list = ", ".join([f"#{k}" for k in recruiting_mids])
                 yield event.plain_result(f"⚠️ 有多个正在招募的对局 ({match_list})，请指定桌号哦")
                 return
 
@@ -170,11 +1848,14 @@ class MahjongPlugin(Star):
 
         # 执行加入
         target_match["players"][user_id] = user_name
+        self.active_index.seat(ctx_id, user_id, target_mid)
         current_count = len(target_match["players"])
-
         if current_count == 4:
             target_match["status"] = "playing"
-            
+            self.active_index.start(ctx_id, target_mid)
+        self._log_table("active", "join", ctx_id, target_mid)
+
+        if current_count == 4:
             # --- 新增：随机分配东南西北风位 ---
             winds =["东", "南", "西", "北"]
             player_list = list(target_match["players"].values())
@@ -192,6 +1873,7 @@ class MahjongPlugin(Star):
             yield event.plain_result(f"选手 {user_name} 加入对局 #{target_mid} ！ ({current_count}/4)")
 
     @command("mj_cancel", alias=["取消对局", "撤销对局", "关闭对局"])
+    @_group_serialized
     async def cancel_match(self, event: AstrMessageEvent):
         """自动识别并解散用户当前所在的对局"""
         ctx_id = self._get_context_id(event)
@@ -201,11 +1883,8 @@ class MahjongPlugin(Star):
         
         if match:
             status = match["status"]
-            del self.active_matches[ctx_id][mid]
-            
-            # 维护外层字典整洁
-            if not self.active_matches[ctx_id]:
-                del self.active_matches[ctx_id]
+            self.active_index.remove(ctx_id, mid)
+            self._log_table("active", "cancel", ctx_id, mid)
                 
             if status == "recruiting":
                 yield event.plain_result(f"🚫 已关闭对局招募 (桌号 #{mid})。")
@@ -215,8 +1894,13 @@ class MahjongPlugin(Star):
             yield event.plain_result("⚠️ 你当前不在任何进行中的对局哦")
 
     @command("mj_end", alias=["对局结束", "得点"])
-    async def end_match(self, event: AstrMessageEvent, score: int):
-        """自动识别用户所在的对局并录入分数"""
+    @_group_serialized
+    async def end_match(self, event: AstrMessageEvent, score: str = ""):
+        """
+        自动识别用户所在的对局并录入分数
+        用法: /得点 [点数] (各自报分，4 人报齐后结算)
+              /得点 @A 45000 @B 30000 @C 15000 @D 10000 (一人替全桌报分，核算通过立即结算)
+        """
         ctx_id = self._get_context_id(event)
         user_id = event.get_sender_id()
         
@@ -230,32 +1914,32 @@ class MahjongPlugin(Star):
             yield event.plain_result(f"⚠️ 对局 #{mid} 尚未开始")
             return
 
+        # @ 到本桌两人以上才按一人替全桌报分处理
+        batch = self._parse_batch_scores(event)
+        if len(set(batch) & set(match["players"])) > 1:
+            for item in self._submit_batch_scores(event, ctx_id, match, mid, batch):
+                yield item
+            return
+
+        score = str(score).strip()
+        if not score.lstrip("-").isdigit():
+            yield event.plain_result("⚠️ 用法: /得点 [点数]，或 /得点 @A 点数 @B 点数 @C 点数 @D 点数 一次报全桌")
+            return
+        score = int(score)
+
         # 记录分数 (允许覆盖修改)
         match["scores"][user_id] = score
         submitted_count = len(match["scores"])
+        self._log_table("active", "score", ctx_id, mid)
         
         # 检查是否满4人数据
         if submitted_count == 4:
             total_score = sum(match["scores"].values())
             
             if total_score != 100000:
-                diff = total_score - 100000
-                diff_str = f"+{diff}" if diff > 0 else f"{diff}"
-                
-                details = []
-                for uid, s in match["scores"].items():
-                    name = match["players"][uid]
-                    details.append(f"{name}: {s}")
-                details_str = "\n".join(details)
-                
-                yield event.plain_result(
-                    f"⚠️ 对局 #{mid} 点数核算不通过\n"
-                    f"四家得点之和为 {total_score} (误差 {diff_str})\n"
-                    f"目标: 100000\n"
-                    f"----------------\n"
-                    f"当前提交:\n{details_str}\n"
-                    f"👉 请本桌发现错误的选手重新发送 /得点 [正确点数] 修正。"
-                )
+                yield event.plain_result(self._score_mismatch_text(
+                    mid, match, match["scores"], "👉 请本桌发现错误的选手重新发送 /得点 [正确点数] 修正。"
+                ))
                 return 
 
             yield event.plain_result(f"✅ 对局 #{mid} 点数核算通过 (100000)，正在结算...")
@@ -265,61 +1949,101 @@ class MahjongPlugin(Star):
         else:
             yield event.plain_result(f"💾 分数已记录 ({submitted_count}/4)")
 
+    @staticmethod
+    def _parse_batch_scores(event: AstrMessageEvent) -> dict:
+        """
+        解析 /得点 @A 45000 @B 30000 ... 中的 @ 与点数，返回 {uid: 点数}
+        @ 后面没有跟点数的选手记为 None；消息里没有 @ 时返回空字典
+        用 @机器人 唤醒时的那个 @ 不算在内
+        """
+        scores = {}
+        target = None
+        self_id = str(event.get_self_id())
+        for comp in event.get_messages():
+            if isinstance(comp, At):
+                if str(comp.qq) == self_id:
+                    continue
+                target = str(comp.qq)
+                scores[target] = None
+            elif isinstance(comp, Plain) and target is not None:
+                for token in comp.text.split():
+                    if token.lstrip("-").isdigit():
+                        scores[target] = int(token)
+                        target = None
+                        break
+        return scores
+
+    @staticmethod
+    def _score_mismatch_text(mid: str, match: dict, scores: dict, hint: str) -> str:
+        total_score = sum(scores.values())
+        diff = total_score - 100000
+        diff_str = f"+{diff}" if diff > 0 else f"{diff}"
+        details_str = "\n".join(f"{match['players'][uid]}: {s}" for uid, s in scores.items())
+        return (
+            f"⚠️ 对局 #{mid} 点数核算不通过\n"
+            f"四家得点之和为 {total_score} (误差 {diff_str})\n"
+            f"目标: 100000\n"
+            f"----------------\n"
+            f"当前提交:\n{details_str}\n"
+            f"{hint}"
+        )
+
+    def _submit_batch_scores(self, event, ctx_id, match, mid, batch):
+        """一次录入全桌分数：整体核算，不通过则一个分数都不记录，通过则直接结算 (只落盘一次)"""
+        if set(batch) != set(match["players"]) or None in batch.values():
+            yield event.plain_result(
+                f"⚠️ 批量报分需要 @ 对局 #{mid} 的全部 4 位选手，并在每人后面写上点数\n"
+                f"示例: /得点 @A 45000 @B 30000 @C 15000 @D 10000"
+            )
+            return
+
+        if sum(batch.values()) != 100000:
+            yield event.plain_result(self._score_mismatch_text(
+                mid, match, batch, "👉 本次提交未记录，请核对后重新发送 /得点 @选手 点数 ..."
+            ))
+            return
+
+        # 核算通过后直接结算，不再单独记录报分
+        match["scores"] = batch
+        yield event.plain_result(f"✅ 对局 #{mid} 点数核算通过 (100000)，正在结算...")
+        for item in self._finalize_match(event, ctx_id, match, mid):
+            yield item
+
     def _finalize_match(self, event, ctx_id, match, mid):
         """结算对局核心逻辑（含同分平分马点机制 + 总得点记录）"""
         sorted_scores = sorted(match["scores"].items(), key=lambda x: x[1], reverse=True)
-        ctx_data = self.data.setdefault(ctx_id, {})
+        ctx_data = self._get_ctx_data(ctx_id, create=True)
         result_msg =[f"🀄️ 对局结束"]
         
-        UMA_SLOTS =[50.0, 10.0, -10.0, -30.0]
         ICONS =["🥇", "🥈", "🥉", "💀"]
 
-        i = 0
-        while i < len(sorted_scores):
-            j = i + 1
-            while j < len(sorted_scores) and sorted_scores[j][1] == sorted_scores[i][1]:
-                j += 1
-            
-            current_umas = UMA_SLOTS[i:j]
-            avg_uma = sum(current_umas) / len(current_umas)
-            
-            for k in range(i, j):
-                uid, score = sorted_scores[k]
-                username = match["players"][uid]
-                
-                base_pt = (score - 30000) / 1000.0
-                final_pt = round(base_pt + avg_uma, 1)
-                pt_str = f"+{final_pt}" if final_pt > 0 else f"{final_pt}"
-                
-                user_stat = ctx_data.setdefault(uid, {
-                    "name": username, "total_pt": 0.0, "total_matches": 0,
-                    "ranks": [0, 0, 0, 0], "max_score": 0, "total_score": 0, "avoid_4_rate": 0.0
-                })
-                
-                if "total_score" not in user_stat: user_stat["total_score"] = 0
-                user_stat["name"] = username
-                user_stat["total_pt"] = round(user_stat["total_pt"] + final_pt, 1)
-                user_stat["total_matches"] += 1
-                user_stat["ranks"][i] += 1
-                user_stat["total_score"] += score
-                
-                if score > user_stat["max_score"]: user_stat["max_score"] = score
-                not_4th_count = sum(user_stat["ranks"][:3])
-                user_stat["avoid_4_rate"] = round((not_4th_count / user_stat["total_matches"]) * 100, 2)
-                
-                result_msg.append(f"{ICONS[i]} {username}: {score} ({pt_str}pt)")
-            i = j
+        # 对局记录：四家按名次排列，slots 为计入的顺位 (同分取较高者)，uma 为同分平分后的马点
+        record = {"type": "game", "table": mid, "uids": [], "names": [], "scores": [], "slots": [], "uma": [], "pt": []}
+
+        settled = _settle_scores([score for _, score in sorted_scores])
+        for (uid, score), (slot, avg_uma, final_pt) in zip(sorted_scores, settled):
+            username = match["players"][uid]
+            pt_str = f"+{final_pt}" if final_pt > 0 else f"{final_pt}"
+
+            user_stat = self._get_player(ctx_data, uid, username)
+            user_stat.record_game(username, slot, score, final_pt)
+            for field, value in zip(("uids", "names", "scores", "slots", "uma", "pt"),
+                                    (uid, username, score, slot, avg_uma, final_pt)):
+                record[field].append(value)
+
+            result_msg.append(f"{ICONS[slot]} {username}: {score} ({pt_str}pt)")
             
-        self._save_data()
+        record = self._record_change(ctx_id, "settle", record["uids"], record)
+        result_msg.append(f"📝 对局记录 #{record['id']}")
 
-        del self.active_matches[ctx_id][mid]
-        if not self.active_matches[ctx_id]:
-            del self.active_matches[ctx_id]
+        self.active_index.remove(ctx_id, mid)
+        self._log_table("active", "settle", ctx_id, mid)
         
         yield event.plain_result("\n".join(result_msg))
 
 
     @command("mj_chombo", alias=["冲和", "错和", "罚分", "chombo"])
+    @_group_serialized
     async def chombo(self, event: AstrMessageEvent):
         """
         错和处罚：扣除指定用户 20pt
@@ -352,43 +2076,35 @@ class MahjongPlugin(Star):
                 break
                 
         # 如果提取完没剩下字，就给个默认备注
-        reason = raw_text if raw_text else "无备注"
+        reason = raw_text[:CHOMBO_REASON_MAX] if raw_text else "无备注"
         # ------------------------
 
-        ctx_data = self.data.setdefault(ctx_id, {})
-        
-        if target_uid not in ctx_data:
-            ctx_data[target_uid] = {
-                "name": f"用户{target_uid}",
-                "total_pt": 0.0,
-                "total_matches": 0,
-                "ranks":[0, 0, 0, 0],
-                "max_score": 0,
-                "total_score": 0,
-                "avoid_4_rate": 0.0
-            }
-        
-        user_data = ctx_data[target_uid]
-        user_data["total_pt"] = round(user_data["total_pt"] - 20.0, 1)
-        self._save_data()
+        ctx_data = self._get_ctx_data(ctx_id, create=True)
+        user_data = self._get_player(ctx_data, target_uid, f"用户{target_uid}")
+        user_data.total_pt = round(user_data.total_pt - 20.0, 1)
+        self._record_change(ctx_id, "chombo", [target_uid], {
+            "type": "chombo", "uid": target_uid, "name": user_data.name, "pt": -20.0, "reason": reason,
+        })
         
         # --- 修改：在返回消息中展示备注 ---
         yield event.plain_result(
             f"🚫 **Chombo 处罚执行**\n"
-            f"对象: {user_data['name']}\n"
+            f"对象: {user_data.name}\n"
             f"原因: {reason}\n"
             f"惩罚: -20 pt\n"
-            f"当前 PT: {user_data['total_pt']}"
+            f"当前 PT: {user_data.total_pt}"
         )
 
     @command("mj_rank", alias=["rank", "排行", "Rank", "RANK"])
-    async def show_rank(self, event: AstrMessageEvent, query_type: str):
+    async def show_rank(self, event: AstrMessageEvent, query_type: str, option: str = "", page: str = ""):
         """
         查询排行榜
         参数: pt / 排位 / 位次 / 最高得点 / 避四率
+        翻页: /rank pt 2 查看第 2 页，/rank pt top=10 只看前 10 名
+        时间段: /rank pt week 最近 7 天，/rank pt month 最近 30 天 (可再跟页码)
         """
         ctx_id = self._get_context_id(event)
-        ctx_data = self.data.get(ctx_id, {})
+        ctx_data = self._get_ctx_data(ctx_id)
         
         if not ctx_data:
             yield event.plain_result("⚠️ 暂无对局记录。")
@@ -398,72 +2114,138 @@ class MahjongPlugin(Star):
         if ctx_data.get("is_playoffs"):
              yield event.plain_result("🏆 当前处于季后赛，请使用 /finals_rank 或 /决赛榜 查询决赛战况。\n以下显示常规赛历史数据：")
 
-        users = list(ctx_data.items())
+        days = RANK_WINDOWS.get(str(option).strip().lower())
+        if days is not None:
+            if query_type.lower() not in ["pt", "原始pt", "分数", "总分"]:
+                yield event.plain_result("⚠️ 时间段榜单目前只支持 PT 榜，例如 /rank pt week、/rank pt month")
+                return
+            windows = await self._get_windows(ctx_id)
+            today = _day_of(time.time())
+            cache_key = (ctx_id, "rank", "window", days, page, today, self._versions.get(ctx_id, 0))
+            text = self._render_cache.get(cache_key)
+            if text is None:
+                text = self._render_window_rank(windows, days, today, page, f"/rank {query_type} {option}")
+                self._render_cache.put(cache_key, text)
+            yield event.plain_result(text)
+            return
+
+        cache_key = (ctx_id, "rank", query_type, option, self._versions.get(ctx_id, 0))
+        text = self._render_cache.get(cache_key)
+        if text is None:
+            text = self._render_rank(ctx_id, query_type, option)
+            if text is None:
+                yield event.plain_result("❓ 未知查询类型。\n请使用: pt (原始分), 排位 (含罚分), 位次, 最高得点, 避四率")
+                return
+            self._render_cache.put(cache_key, text)
+
+        yield event.plain_result(text)
+
+    async def _get_windows(self, ctx_id: str) -> WindowBuckets:
+        """取该群的时间段分桶，首次查询时由本赛季对局记录建立"""
+        while ctx_id not in self._windows:
+            version = self._versions.get(ctx_id, 0)
+            records = await self._load_season_records(ctx_id)
+            if self._versions.get(ctx_id, 0) != version:
+                # 读记录期间又有新的变动，重新读一次，避免漏记
+                continue
+            windows = WindowBuckets()
+            for record in _effective_records(records):
+                windows.add(record)
+            self._windows[ctx_id] = windows
+        return self._windows[ctx_id]
+
+    async def _get_forms(self, ctx_id: str) -> dict:
+        """取该群各选手的近期状态 {uid: RecentForm}，首次查询时由本赛季对局记录建立"""
+        while ctx_id not in self._forms:
+            version = self._versions.get(ctx_id, 0)
+            records = await self._load_season_records(ctx_id)
+            if self._versions.get(ctx_id, 0) != version:
+                continue
+            forms = {}
+            for record in _effective_records(records):
+                if record["type"] == "game":
+                    self._push_form(forms, record)
+            self._forms[ctx_id] = forms
+        return self._forms[ctx_id]
+
+    @staticmethod
+    def _push_form(forms: dict, record: dict):
+        # 按当前规则重新结算，与重算后的累计数据一致
+        for uid, _, score, slot, pt in _game_results(record):
+            form = forms.get(uid)
+            if form is None:
+                form = forms[uid] = RecentForm()
+            form.push(slot, score, pt)
+
+    def _render_window_rank(self, windows: WindowBuckets, days: int, today: int, option: str, next_cmd: str) -> str:
+        """渲染最近 days 天的 PT 榜"""
+        start, stop, page = self._parse_page(option)
+        rows = windows.top(days, today)
+        if not rows:
+            return f"⚠️ 最近 {days} 天还没有对局记录。"
+        msg_lines = [f"📅 **最近 {days} 天 PT榜**"]
+        for i, (uid, name, pt, games) in enumerate(rows[start:stop], start):
+            pt_str = f"+{pt}" if pt > 0 else f"{pt}"
+            msg_lines.append(f"{i+1}. {name} — {pt_str} pt [试合:{games}]")
+        msg_lines += self._page_footer(page, len(rows), next_cmd)
+        return "\n".join(msg_lines)
+
+    def _render_rank(self, ctx_id: str, query_type: str, option: str):
+        """渲染排行榜文本，未知榜单类型返回 None"""
+        start, stop, page = self._parse_page(option)
         msg_lines = []
+        total = 0
 
         # --- 1. 原始PT榜 (Total PT) ---
         if query_type.lower() in ["pt", "原始pt", "分数", "总分"]:
             msg_header = "📊 **常规赛 PT榜** "
-            # 按 total_pt 排序
-            sorted_users = sorted(users, key=lambda x: x[1]["total_pt"], reverse=True)
-            
             msg_lines = [msg_header]
-            for i, (uid, data) in enumerate(sorted_users):
-                msg_lines.append(f"{i+1}. {data['name']} — {data['total_pt']} pt [试合:{data['total_matches']}]")
+            users, total = self._sorted_users(ctx_id, "pt", start, stop)
+            for i, (uid, data) in enumerate(users, start):
+                msg_lines.append(f"{i+1}. {data.name} — {data.total_pt} pt [试合:{data.total_matches}]")
             
         # --- 2. 排位PT榜 (Ranking PT, 含罚分) ---
         elif query_type in ["排位", "排名", "排位pt", "ranking"]:
             msg_header = "🏆 **赛季排位榜**"
-            
-            # 临时列表用于排序: (uid, data, ranking_pt, penalty)
-            ranked_list = []
-            for uid, data in users:
-                raw_pt = data["total_pt"]
-                matches = data["total_matches"]
-                penalty = max(0, 20 - matches) * 50
-                ranking_pt = raw_pt - penalty
-                ranked_list.append((uid, data, ranking_pt, penalty))
-            
-            # 按计算后的排位分排序
-            ranked_list.sort(key=lambda x: x[2], reverse=True)
-            
             msg_lines = [msg_header]
-            for i, (uid, data, r_pt, penalty) in enumerate(ranked_list):
+            users, total = self._sorted_users(ctx_id, "ranking", start, stop)
+            for i, (uid, data) in enumerate(users, start):
+                penalty = _ranking_penalty(data.total_matches)
+                r_pt = data.total_pt - penalty
                 # 显示: 排名. 名字 — 排位分 (罚:xxx)
                 note = f"(罚:{penalty})" if penalty > 0 else ""
                 # 如果是决赛选手，可以加个标记（可选）
-                mark = "🔥" if data.get("is_finalist") else ""
+                mark = "🔥" if data.is_finalist else ""
                 
-                msg_lines.append(f"{i+1}. {data['name']} {mark} — {round(r_pt, 1)} pt {note} [{data['total_matches']}/20]")
+                msg_lines.append(f"{i+1}. {data.name} {mark} — {round(r_pt, 1)} pt {note} [{data.total_matches}/20]")
 
         # --- 3. 其他常规榜单 ---
         elif query_type in ["位次", "一位率"]:
             msg_header = "👑 **一位次数 排行榜**"
-            sorted_users = sorted(users, key=lambda x: (x[1]["ranks"][0], -x[1]["total_matches"]), reverse=True)
             msg_lines = [msg_header]
-            for i, (uid, data) in enumerate(sorted_users):
-                msg_lines.append(f"{i+1}. {data['name']} — 一位 {data['ranks'][0]} 次 / {data['total_matches']} 场")
+            users, total = self._sorted_users(ctx_id, "first", start, stop)
+            for i, (uid, data) in enumerate(users, start):
+                msg_lines.append(f"{i+1}. {data.name} — 一位 {data.ranks[0]} 次 / {data.total_matches} 场")
             
         elif query_type in ["最高得点", "最大得点"]:
             msg_header = "💥 **单场最高得点 排行榜**"
-            sorted_users = sorted(users, key=lambda x: x[1]["max_score"], reverse=True)
             msg_lines = [msg_header]
-            for i, (uid, data) in enumerate(sorted_users):
-                msg_lines.append(f"{i+1}. {data['name']} — {data['max_score']} 点")
+            users, total = self._sorted_users(ctx_id, "max_score", start, stop)
+            for i, (uid, data) in enumerate(users, start):
+                msg_lines.append(f"{i+1}. {data.name} — {data.max_score} 点")
             
         elif query_type in ["避四率", "避四"]:
             msg_header = "🛡️ **避四率 排行榜** (至少5场)"
-            valid_users = [u for u in users if u[1]["total_matches"] >= 5]
-            sorted_users = sorted(valid_users, key=lambda x: x[1]["avoid_4_rate"], reverse=True)
             msg_lines = [msg_header]
-            for i, (uid, data) in enumerate(sorted_users):
-                msg_lines.append(f"{i+1}. {data['name']} — {data['avoid_4_rate']}% (共{data['total_matches']}场)")
+            users, total = self._sorted_users(ctx_id, "avoid_4", start, stop)
+            for i, (uid, data) in enumerate(users, start):
+                msg_lines.append(f"{i+1}. {data.name} — {data.avoid_4_rate}% (共{data.total_matches}场)")
             
         else:
-            yield event.plain_result("❓ 未知查询类型。\n请使用: pt (原始分), 排位 (含罚分), 位次, 最高得点, 避四率")
-            return
+            return None
 
-        yield event.plain_result("\n".join(msg_lines))
+        msg_lines += self._page_footer(page, total, f"/rank {query_type}")
+        return "\n".join(msg_lines)
 
     @command("mj_stats", alias=["个人数据", "查数据", "战绩", "吃鱼"])
     async def my_stats(self, event: AstrMessageEvent):
@@ -473,7 +2255,7 @@ class MahjongPlugin(Star):
               /吃鱼 @被查询用户 (查询他人)
         """
         ctx_id = self._get_context_id(event)
-        ctx_data = self.data.get(ctx_id, {})
+        ctx_data = self._get_ctx_data(ctx_id)
         
         if not ctx_data:
             yield event.plain_result("⚠️ 暂无对局记录。")
@@ -489,7 +2271,7 @@ class MahjongPlugin(Star):
                 target_uid = str(comp.qq)
                 # 尝试从数据中获取名字，获取不到就用默认占位
                 if target_uid in ctx_data:
-                    target_name = ctx_data[target_uid]["name"]
+                    target_name = ctx_data[target_uid].name
                 else:
                     target_name = f"用户{target_uid}"
                 break
@@ -499,35 +2281,32 @@ class MahjongPlugin(Star):
             return
 
         user = ctx_data[target_uid]
-        total_games = user["total_matches"]
+        total_games = user.total_matches
         
         if total_games == 0:
-            yield event.plain_result(f"⚠️ {user['name']} 还没有完成过对局。")
+            yield event.plain_result(f"⚠️ {user.name} 还没有完成过对局。")
             return
 
-        # 2. 计算排名 (需要遍历所有用户)
-        users_list = []
-        for uid, data in ctx_data.items():
-            # 计算排位分: 原始分 - 罚分
-            raw_pt = data["total_pt"]
-            penalty = max(0, 20 - data["total_matches"]) * 50
-            ranking_pt = raw_pt - penalty
-            users_list.append({
-                "uid": uid,
-                "raw_pt": raw_pt,
-                "ranking_pt": ranking_pt
-            })
-        
-        # 2.1 原始PT排名
-        users_list.sort(key=lambda x: x["raw_pt"], reverse=True)
-        raw_rank = next((i + 1 for i, u in enumerate(users_list) if u["uid"] == target_uid), "N/A")
-        
-        # 2.2 排位PT排名
-        users_list.sort(key=lambda x: x["ranking_pt"], reverse=True)
-        ranking_rank = next((i + 1 for i, u in enumerate(users_list) if u["uid"] == target_uid), "N/A")
+        cache_key = (ctx_id, "stats", target_uid, self._versions.get(ctx_id, 0))
+        text = self._render_cache.get(cache_key)
+        if text is None:
+            await self._get_forms(ctx_id)
+            await self._get_career(ctx_id)
+            text = self._render_stats(ctx_id, target_uid)
+            self._render_cache.put(cache_key, text)
+        yield event.plain_result(text)
+
+    def _render_stats(self, ctx_id: str, target_uid: str) -> str:
+        """渲染个人数据面板"""
+        user = self._get_ctx_data(ctx_id)[target_uid]
+        total_games = user.total_matches
+
+        # 2. 计算排名
+        raw_rank = self._user_position(ctx_id, target_uid, "pt")
+        ranking_rank = self._user_position(ctx_id, target_uid, "ranking")
         
         # 3. 计算各项统计数据
-        ranks = user["ranks"] # [1位数, 2位数, 3位数, 4位数]
+        ranks = user.ranks # [1位数, 2位数, 3位数, 4位数]
         
         # 顺位率
         rates = [f"{r / total_games * 100:.2f}%" for r in ranks]
@@ -537,19 +2316,19 @@ class MahjongPlugin(Star):
         avg_rank_val = rank_sum / total_games
         
         # 平均点数
-        total_score = user.get("total_score", 0) # 兼容旧数据
+        total_score = user.total_score # 兼容旧数据
         avg_score = int(total_score / total_games)
         
         # 排位分计算细节
-        current_penalty = max(0, 20 - total_games) * 50
-        current_ranking_pt = user["total_pt"] - current_penalty
+        current_penalty = _ranking_penalty(total_games)
+        current_ranking_pt = user.total_pt - current_penalty
 
         # 4. 构建面板
         msg = [
-            f"📊 {user['name']} 的赛季数据",
+            f"📊 {user.name} 的赛季数据",
             f"------------------------",
             f"🔢 ===PT排名===",
-            f"• 原始PT: {user['total_pt']} pt (第 {raw_rank} 名)",
+            f"• 原始PT: {user.total_pt} pt (第 {raw_rank} 名)",
             f"• 排位PT: {round(current_ranking_pt, 1)} pt (第 {ranking_rank} 名)",
             f"  *(罚分: -{current_penalty} pt)*",
             f"",
@@ -562,15 +2341,44 @@ class MahjongPlugin(Star):
             f"📐 ===均值统计===",
             f"• 平均顺位: {avg_rank_val:.2f}",
             f"• 平均得点: {avg_score}",
-            f"• 最高得点: {user['max_score']}",
-            f"• 避四率: {user['avoid_4_rate']}%",
+            f"• 最高得点: {user.max_score}",
+            f"• 避四率: {user.avoid_4_rate}%",
             f"",
             f"注意：Season 1的平均得点数据不全，可能不具有实际参考价值。"
         ]
+
+        # 5. 近期状态 (本赛季最近 10/20/50 场)
+        form = self._forms.get(ctx_id, {}).get(target_uid)
+        if form is not None and form.count:
+            recent = [f"📉 ===近期状态==="]
+            shown = set()
+            for i in range(len(FORM_WINDOWS)):
+                games, avg_rank, avg_score, pt_sum = form.window(i)
+                if games in shown:
+                    continue
+                shown.add(games)
+                pt_str = f"+{pt_sum}" if pt_sum > 0 else f"{pt_sum}"
+                recent.append(f"• 近{games}场: 平均顺位 {avg_rank:.2f} / 平均得点 {avg_score} / PT {pt_str}")
+            games, _, _, pt_sum = form.window(0)
+            recent_avg = pt_sum / games
+            season_avg = _season_pt(user) / total_games
+            trend = "↗️ 上升" if recent_avg > season_avg + 1 else "↘️ 下滑" if recent_avg < season_avg - 1 else "➡️ 平稳"
+            recent.append(f"• 走势: {trend} (近{games}场场均 {recent_avg:+.1f}pt / 赛季场均 {season_avg:+.1f}pt)")
+            msg[-1:-1] = recent + [f""]
+
+        # 6. 有往届记录时附上生涯概要
+        past = self._careers[ctx_id]["players"].get(target_uid)
+        if past is not None:
+            msg[-1:-1] = [
+                f"🏛️ 生涯: 往届 {past.seasons} 届，生涯PT {round(past.total_pt + _season_pt(user), 1)} pt (含本赛季)",
+                f"   发送 /生涯 查看完整生涯数据",
+                f"",
+            ]
         
-        yield event.plain_result("\n".join(msg))
+        return "\n".join(msg)
     
     @command("mj_finals_setup", alias=["进入决赛", "季后赛初始化"])
+    @_group_serialized
     async def setup_finals(self, event: AstrMessageEvent):
         """
         [管理员] 初始化决赛模式
@@ -578,7 +2386,7 @@ class MahjongPlugin(Star):
         逻辑: (原始PT - 缺席罚分) / 2 = 决赛初始分
         """
         ctx_id = self._get_context_id(event)
-        ctx_data = self.data.setdefault(ctx_id, {})
+        ctx_data = self._get_ctx_data(ctx_id, create=True)
 
         if ctx_data.get("is_playoffs"):
             yield event.plain_result("⚠️ 错误：当前已经是决赛模式！请勿重复执行。")
@@ -598,34 +2406,17 @@ class MahjongPlugin(Star):
         msg_lines = ["🏆 **已进入季后赛**", "----------------"]
         
         for uid in target_uids:
-            if uid not in ctx_data:
-                ctx_data[uid] = {"name": f"选手{uid}", "total_pt": 0.0, "total_matches": 0, "ranks": [0,0,0,0], "max_score": 0, "avoid_4_rate": 0.0}
-            
-            user = ctx_data[uid]
+            user = self._get_player(ctx_data, uid, f"选手{uid}")
             
-            # 1. 计算常规赛最终排位分 (含罚分逻辑)
-            raw_pt = user["total_pt"]
-            matches = user["total_matches"]
-            penalty = max(0, 20 - matches) * 50
-            ranking_pt = raw_pt - penalty
+            # 计算常规赛最终排位分 (含罚分逻辑)，备份后换算为决赛初始分并标记决赛身份
+            raw_pt, penalty, ranking_pt, start_pt = user.enter_finals()
             
-            # 2. 备份数据 (评奖用)
-            user["regular_raw_pt"] = raw_pt          # 原始分
-            user["regular_ranking_pt"] = ranking_pt  # 罚分后的排位分
-            
-            # 3. 决赛初始分 = 排位分 / 2
-            start_pt = round(ranking_pt / 4, 1)
-            user["total_pt"] = start_pt
-            
-            # 4. 标记决赛身份
-            user["is_finalist"] = True
-            
-            msg_lines.append(f"👤 {user['name']}")
+            msg_lines.append(f"👤 {user.name}")
             msg_lines.append(f"   常规赛: {raw_pt} (罚:{penalty}) = {ranking_pt}")
             msg_lines.append(f"   决赛起始: {start_pt} pt")
 
         ctx_data["is_playoffs"] = True
-        self._save_data()
+        self._record_change(ctx_id, "finals", target_uids + ["is_playoffs"], {"type": "finals", "uids": target_uids})
 
         msg_lines.append("----------------")
         msg_lines.append("✅ 决赛圈已锁定，非决赛选手将无法加入对局。")
@@ -637,42 +2428,513 @@ class MahjongPlugin(Star):
     async def show_finals_rank(self, event: AstrMessageEvent):
         """显示决赛实时排行榜"""
         ctx_id = self._get_context_id(event)
-        ctx_data = self.data.get(ctx_id, {})
+        ctx_data = self._get_ctx_data(ctx_id)
         
         if not ctx_data.get("is_playoffs"):
             yield event.plain_result("⚠️ 当前未进行季后赛，请使用 /rank。")
             return
 
+        cache_key = (ctx_id, "finals", self._versions.get(ctx_id, 0))
+        text = self._render_cache.get(cache_key)
+        if text is None:
+            text = self._render_finals_rank(ctx_data)
+            self._render_cache.put(cache_key, text)
+        yield event.plain_result(text)
+
+    def _render_finals_rank(self, ctx_data: dict) -> str:
         finalists = []
         for uid, data in ctx_data.items():
-            if isinstance(data, dict) and data.get("is_finalist"):
+            if isinstance(data, PlayerStats) and data.is_finalist:
                 finalists.append(data)
         
-        finalists.sort(key=lambda x: x["total_pt"], reverse=True)
+        finalists.sort(key=lambda x: x.total_pt, reverse=True)
 
         msg = ["🏆 **决赛 实时排位**", "(起始分 = 常规赛排位分 / 4)"]
         for i, user in enumerate(finalists):
             # 显示格式：排名. 名字 — 当前总分 (决赛起始分: xxx)
-            start_pt = user.get("regular_ranking_pt", 0) / 4 # 重新算一下仅仅为了展示，或者取 total_pt
+            start_pt = (user.regular_ranking_pt or 0) / 4 # 重新算一下仅仅为了展示，或者取 total_pt
             # 其实直接显示当前分即可，因为 total_pt 已经是折半后+决赛变动的总和了
-            msg.append(f"{i+1}. {user['name']} — {user['total_pt']} pt")
+            msg.append(f"{i+1}. {user.name} — {user.total_pt} pt")
             
-        yield event.plain_result("\n".join(msg))
+        return "\n".join(msg)
 
     @command("mj_reset", alias=["新赛季"])
+    @_group_serialized
     async def reset_season(self, event: AstrMessageEvent):
-        """重置当前群组的所有数据并清除所有正在进行的对局"""
+        """结束本赛季：数据压缩归档后清空，并清除所有正在进行的对局"""
         ctx_id = self._get_context_id(event)
         
-        if ctx_id in self.active_matches:
-            del self.active_matches[ctx_id]
+        self.active_index.clear(ctx_id)
+        self._log_table("active", "reset", ctx_id)
 
-        if ctx_id in self.data:
-            self.data[ctx_id] = {} 
-            self._save_data()
-            yield event.plain_result("🔄 赛季数据已完全重置！\n所有积分已清零，新的赛季请加油！")
-        else:
+        ctx_data = self._get_ctx_data(ctx_id)
+        if not ctx_data:
             yield event.plain_result("⚠️ 当前没有数据可重置。")
+            return
+
+        # 先把本赛季写进归档，成功后才清空热数据并计入生涯汇总
+        career = await self._get_career(ctx_id)
+        season = self._next_season_number(ctx_id)
+        archive = {
+            "ctx_id": ctx_id,
+            "season": season,
+            "archived_at": round(time.time(), 3),
+            "data": ctx_data,
+            "records": await self._load_season_records(ctx_id),
+        }
+        text = json.dumps(archive, ensure_ascii=False, separators=(",", ":"), default=_to_json)
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._write_archive, self._archive_path(ctx_id, season), text
+            )
+        except OSError as e:
+            logger.error(f"赛季归档失败: {e}")
+            yield event.plain_result(f"❌ 赛季归档失败，数据未重置: {e}")
+            return
+
+        self._add_career_season(career, season, ctx_data)
+        self._save_career(ctx_id)
+        self.data[ctx_id] = {} 
+        record = self._record_change(ctx_id, "reset", record={"type": "reset", "season": season})
+        if not self.sql:
+            # 对局记录文件只保留这条重置记录，编号据此接着往下排
+            line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+            path = self._group_path(ctx_id, MATCHES_SUFFIX)
+            self._writer.submit(partial(self._write_file, path, line), key=path)
+            # 立即压缩成空快照，之后加载该群不必再读上赛季的数据
+            self._save_data(ctx_id)
+        yield event.plain_result(
+            f"🔄 第 {season} 届赛季已归档，赛季数据已完全重置！\n"
+            f"所有积分已清零，新的赛季请加油！\n"
+            f"📚 往届成绩可用 /历史赛季 查询。"
+        )
+
+    @staticmethod
+    def _archive_path(ctx_id: str, season: int) -> str:
+        return os.path.join(ARCHIVE_DIR, quote(ctx_id, safe=""), f"season_{season}.json.gz")
+
+    @staticmethod
+    def _archived_seasons(ctx_id: str) -> list:
+        folder = os.path.join(ARCHIVE_DIR, quote(ctx_id, safe=""))
+        if not os.path.isdir(folder):
+            return []
+        matches = (ARCHIVE_PATTERN.match(name) for name in os.listdir(folder))
+        return sorted(int(m.group(1)) for m in matches if m)
+
+    def _next_season_number(self, ctx_id: str) -> int:
+        seasons = self._archived_seasons(ctx_id)
+        return seasons[-1] + 1 if seasons else 1
+
+    def _write_archive(self, path: str, text: str):
+        """[后台线程] 压缩后原子写入归档文件"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            f.write(text)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _read_archive(path: str) -> dict:
+        """[后台线程] 读取并解压一个往届赛季归档"""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            archive = json.load(f)
+        archive["data"] = _group_from_json(archive["data"])
+        return archive
+
+    async def _get_archive(self, ctx_id: str, season: int):
+        """按需加载往届赛季 (只读)，最近用过的几份留在内存里；不存在时返回 None"""
+        key = (ctx_id, season)
+        archive = self._archives.get(key)
+        if archive is None:
+            path = self._archive_path(ctx_id, season)
+            if not os.path.exists(path):
+                return None
+            archive = await asyncio.get_running_loop().run_in_executor(None, self._read_archive, path)
+            self._archives[key] = archive
+            while len(self._archives) > ARCHIVE_CACHE_SIZE:
+                self._archives.popitem(last=False)
+        self._archives.move_to_end(key)
+        return archive
+
+    async def _get_career(self, ctx_id: str) -> dict:
+        """
+        取本群的生涯汇总 {"seasons": [已计入的届数], "players": {uid: CareerStats}}
+        首次访问时在后台线程读入；若有尚未计入的往届归档 (如汇总文件丢失或损坏) 则按归档补算一次
+        """
+        career = self._careers.get(ctx_id)
+        if career is None:
+            loaded, backfilled = await asyncio.get_running_loop().run_in_executor(None, self._load_career, ctx_id)
+            # 等待期间可能已有别的请求读好了，以先读好的为准
+            career = self._careers.setdefault(ctx_id, loaded)
+            if backfilled and career is loaded:
+                self._save_career(ctx_id)
+        return career
+
+    def _load_career(self, ctx_id: str) -> tuple:
+        """[后台线程] 读出生涯汇总并补算缺少的往届，返回 (生涯汇总, 是否有补算)；损坏的归档记日志后跳过"""
+        career = {"seasons": [], "players": {}}
+        path = os.path.join(ARCHIVE_DIR, quote(ctx_id, safe=""), CAREER_FILE)
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    raw = json.load(f)
+                career["seasons"] = raw.get("seasons", [])
+                career["players"] = {uid: CareerStats.from_dict(d) for uid, d in raw.get("players", {}).items()}
+            except (OSError, ValueError) as e:
+                logger.error(f"读取生涯汇总失败，将按归档重新汇总: {e}")
+                career = {"seasons": [], "players": {}}
+        backfilled = False
+        for season in self._archived_seasons(ctx_id):
+            if season in career["seasons"]:
+                continue
+            try:
+                archive = self._read_archive(self._archive_path(ctx_id, season))
+            except (OSError, EOFError, ValueError, KeyError) as e:
+                logger.error(f"读取第 {season} 届赛季归档失败，生涯汇总中跳过该届: {e}")
+                continue
+            self._add_career_season(career, season, archive["data"])
+            backfilled = True
+        return career, backfilled
+
+    @staticmethod
+    def _add_career_season(career: dict, season: int, ctx_data: dict):
+        for uid, user in ctx_data.items():
+            if isinstance(user, PlayerStats) and user.total_matches:
+                stats = career["players"].get(uid)
+                if stats is None:
+                    stats = career["players"][uid] = CareerStats(user.name)
+                stats.add_season(user)
+        career["seasons"].append(season)
+
+    def _save_career(self, ctx_id: str):
+        path = os.path.join(ARCHIVE_DIR, quote(ctx_id, safe=""), CAREER_FILE)
+        text = json.dumps(self._careers[ctx_id], ensure_ascii=False, separators=(",", ":"), default=_to_json)
+        self._writer.submit(partial(self._write_file, path, text), key=path)
+
+    @command("mj_career", alias=["生涯", "生涯数据"])
+    async def show_career(self, event: AstrMessageEvent):
+        """
+        查询生涯数据 (历届赛季合计，含本赛季)
+        用法: /生涯 (查询自己)
+              /生涯 @被查询用户 (查询他人)
+        """
+        ctx_id = self._get_context_id(event)
+        target_uid = event.get_sender_id()
+        for comp in event.get_messages():
+            if isinstance(comp, At):
+                target_uid = str(comp.qq)
+                break
+
+        cache_key = (ctx_id, "career", target_uid, self._versions.get(ctx_id, 0))
+        text = self._render_cache.get(cache_key)
+        if text is None:
+            await self._get_career(ctx_id)
+            text = self._render_career(ctx_id, target_uid)
+            self._render_cache.put(cache_key, text)
+        yield event.plain_result(text)
+
+    def _render_career(self, ctx_id: str, target_uid: str) -> str:
+        """渲染生涯面板：往届汇总 + 本赛季当前数据，与已有多少届无关 (生涯汇总须已由 _get_career 读入)"""
+        past = self._careers[ctx_id]["players"].get(target_uid)
+        current = self._get_ctx_data(ctx_id).get(target_uid)
+        total = CareerStats.from_dict(past.to_dict()) if past is not None else CareerStats(f"用户{target_uid}")
+        if isinstance(current, PlayerStats) and current.total_matches:
+            total.add_season(current)
+        if total.total_matches == 0:
+            return f"⚠️ 未找到 {total.name} 的对局记录。"
+
+        games = total.total_matches
+        rates = [f"{r / games * 100:.2f}%" for r in total.ranks]
+        avg_rank = sum((i + 1) * count for i, count in enumerate(total.ranks)) / games
+        note = " (含本赛季)" if isinstance(current, PlayerStats) and current.total_matches else ""
+        msg = [
+            f"🏛️ {total.name} 的生涯数据",
+            f"------------------------",
+            f"• 参赛: {total.seasons} 届{note}，进入决赛 {total.finals} 次",
+            f"• 生涯PT: {total.total_pt} pt",
+            f"",
+            f"📈 ===对局详情=== (共 {games} 场)",
+            f"🥇 一位率: {rates[0]} ({total.ranks[0]}回)",
+            f"🥈 二位率: {rates[1]} ({total.ranks[1]}回)",
+            f"🥉 三位率: {rates[2]} ({total.ranks[2]}回)",
+            f"💀 四位率: {rates[3]} ({total.ranks[3]}回)",
+            f"",
+            f"📐 ===均值统计===",
+            f"• 平均顺位: {avg_rank:.2f}",
+            f"• 平均得点: {int(total.total_score / games)}",
+            f"• 最高得点: {total.max_score}",
+        ]
+        return "\n".join(msg)
+
+    @command("mj_history", alias=["历史赛季", "往届"])
+    async def show_archived_season(self, event: AstrMessageEvent, season: str = ""):
+        """
+        查询往届赛季 (只读)
+        用法: /历史赛季 (列出往届赛季)
+              /历史赛季 [届数] (该届最终 PT 榜前 20 名)
+              /历史赛季 [届数] @选手 (该选手当届数据)
+        """
+        ctx_id = self._get_context_id(event)
+        seasons = self._archived_seasons(ctx_id)
+        if not seasons:
+            yield event.plain_result("⚠️ 本群还没有归档的往届赛季。")
+            return
+
+        season = str(season).strip().lstrip("第").rstrip("届赛季")
+        if not season.isdigit():
+            yield event.plain_result(
+                "📚 **往届赛季**\n"
+                + "、".join(f"第 {n} 届" for n in seasons)
+                + "\n发送 /历史赛季 [届数] 查看当届排行，/历史赛季 [届数] @选手 查看个人数据"
+            )
+            return
+
+        archive = await self._get_archive(ctx_id, int(season))
+        if archive is None:
+            yield event.plain_result(f"⚠️ 找不到第 {season} 届的归档。")
+            return
+        data = archive["data"]
+        archived_at = time.strftime("%Y-%m-%d", time.localtime(archive["archived_at"]))
+
+        target_uid = None
+        for comp in event.get_messages():
+            if isinstance(comp, At):
+                target_uid = str(comp.qq)
+                break
+
+        if target_uid is not None:
+            user = data.get(target_uid)
+            if not isinstance(user, PlayerStats) or user.total_matches == 0:
+                yield event.plain_result(f"⚠️ 第 {season} 届没有该选手的对局记录。")
+                return
+            ranks = user.ranks
+            avg_rank = sum((i + 1) * count for i, count in enumerate(ranks)) / user.total_matches
+            lines = [
+                f"📚 {user.name} · 第 {season} 届 (归档于 {archived_at})",
+                f"• 最终PT: {user.total_pt} pt" + (" 🔥决赛选手" if user.is_finalist else ""),
+                f"• 对局: {user.total_matches} 场 (一位 {ranks[0]} / 二位 {ranks[1]} / 三位 {ranks[2]} / 四位 {ranks[3]})",
+                f"• 平均顺位: {avg_rank:.2f}",
+                f"• 平均得点: {int(user.total_score / user.total_matches)}",
+                f"• 最高得点: {user.max_score}",
+                f"• 避四率: {user.avoid_4_rate}%",
+            ]
+            if user.regular_ranking_pt is not None:
+                lines.append(f"• 常规赛排位PT: {user.regular_ranking_pt} pt")
+            yield event.plain_result("\n".join(lines))
+            return
+
+        users = [(uid, user) for uid, user in data.items() if isinstance(user, PlayerStats)]
+        top = heapq.nsmallest(RANK_PAGE_SIZE, users, key=lambda item: (BOARD_KEYS["pt"](item[1]), item[0]))
+        lines = [f"📚 **第 {season} 届 最终PT榜** (归档于 {archived_at}，共 {len(users)} 人)"]
+        for i, (uid, user) in enumerate(top):
+            mark = "🔥" if user.is_finalist else ""
+            lines.append(f"{i+1}. {user.name} {mark} — {user.total_pt} pt [试合:{user.total_matches}]")
+        yield event.plain_result("\n".join(lines))
+
+    async def _load_season_records(self, ctx_id: str) -> list:
+        """读出该群本赛季的全部对局记录 (JSON 后端在后台线程读文件)"""
+        if self.sql:
+            return self.sql.season_records(ctx_id)
+        loop = asyncio.get_running_loop()
+        # 先等写盘线程把已提交的对局记录写完
+        await loop.run_in_executor(None, self._writer.flush)
+        return await loop.run_in_executor(None, self._read_season_records, ctx_id)
+
+    def _revert_game(self, ctx_data: dict, game: dict) -> tuple:
+        """
+        从累计数据中扣除一场对局的 PT、顺位和得点 (按当前规则重新结算后扣除，与重算结果一致)
+        返回 (最高得点受影响、需要重新求的选手, 按名次排列的扣除明细 _game_results)
+        """
+        stale = []
+        results = _game_results(game)
+        for uid, _, score, slot, pt in results:
+            user = self._get_player(ctx_data, uid, f"选手{uid}")
+            if user.undo_game(slot, score, pt):
+                stale.append(uid)
+        return stale, results
+
+    def _refresh_max_scores(self, ctx_data: dict, records: list, uids: list):
+        """按对局记录重新求最高得点；有对局早于记录开始的选手保留原值，以免把更早的最高得点改低"""
+        counts = _history_counts(records)
+        for uid, best in _max_scores(records, uids).items():
+            if ctx_data[uid].total_matches <= counts.get(uid, 0):
+                ctx_data[uid].max_score = best
+
+    @staticmethod
+    def _parse_match_id(text: str):
+        text = str(text).strip().lstrip("#")
+        return int(text) if text.isdigit() else None
+
+    @command("mj_undo", alias=["撤销结算"])
+    @_group_serialized
+    async def undo_match(self, event: AstrMessageEvent, match_id: str = ""):
+        """
+        [管理员] 撤销一场已结算的对局，扣回该局计入的全部数据
+        用法: /撤销结算 [对局记录编号]
+        """
+        ctx_id = self._get_context_id(event)
+        record_id = self._parse_match_id(match_id)
+        if record_id is None:
+            yield event.plain_result("⚠️ 用法: /撤销结算 [对局记录编号]，编号见结算消息末尾的 📝 对局记录 #编号")
+            return
+
+        records = await self._load_season_records(ctx_id)
+        game, error = _match_state(records, record_id)
+        if error:
+            yield event.plain_result(f"⚠️ {error}")
+            return
+
+        ctx_data = self._get_ctx_data(ctx_id, create=True)
+        stale, reverted = self._revert_game(ctx_data, game)
+        change = {"type": "void", "target": record_id}
+        if stale:
+            self._refresh_max_scores(ctx_data, records + [{"id": None, **change}], stale)
+        self._record_change(ctx_id, "void", game["uids"], change)
+
+        lines = [f"↩️ 已撤销对局 #{record_id}"]
+        for uid, name, score, _, pt in reverted:
+            pt_str = f"+{pt}" if pt > 0 else f"{pt}"
+            lines.append(f"{name}: {score} ({pt_str}pt 已撤回) → 当前 {ctx_data[uid].total_pt} pt")
+        yield event.plain_result("\n".join(lines))
+
+    @command("mj_fix", alias=["修正", "修正结算"])
+    @_group_serialized
+    async def fix_match(self, event: AstrMessageEvent, match_id: str = ""):
+        """
+        [管理员] 修正一场已结算对局的得点，按新得点重新结算
+        用法: /修正 [对局记录编号] @A 点数 @B 点数 @C 点数 @D 点数
+              /修正 [对局记录编号] 点数1 点数2 点数3 点数4 (按原结算消息中的顺序)
+        """
+        ctx_id = self._get_context_id(event)
+        record_id = self._parse_match_id(match_id)
+        if record_id is None:
+            yield event.plain_result("⚠️ 用法: /修正 [对局记录编号] @A 点数 @B 点数 @C 点数 @D 点数")
+            return
+
+        records = await self._load_season_records(ctx_id)
+        game, error = _match_state(records, record_id)
+        if error:
+            yield event.plain_result(f"⚠️ {error}")
+            return
+
+        names = dict(zip(game["uids"], game["names"]))
+        scores = self._parse_batch_scores(event)
+        if not scores:
+            # 没有 @ 时按原结算顺序读取编号后面的 4 个点数
+            numbers = [
+                int(token) for token in event.message_str.split()
+                if token.lstrip("-").isdigit()
+            ]
+            if numbers and numbers[0] == record_id:
+                numbers = numbers[1:]
+            scores = dict(zip(game["uids"], numbers)) if len(numbers) == 4 else {}
+        order = "、".join(game["names"])
+        if set(scores) != set(game["uids"]) or None in scores.values():
+            yield event.plain_result(
+                f"⚠️ 请给出对局 #{record_id} 全部 4 位选手的新点数\n"
+                f"示例: /修正 {record_id} @A 45000 @B 30000 @C 15000 @D 10000\n"
+                f"或按顺序 ({order}): /修正 {record_id} 点数1 点数2 点数3 点数4"
+            )
+            return
+        total_score = sum(scores.values())
+        if total_score != 100000:
+            yield event.plain_result(f"⚠️ 四家得点之和为 {total_score}，应为 100000，未做修改。")
+            return
+
+        ctx_data = self._get_ctx_data(ctx_id, create=True)
+        stale, _ = self._revert_game(ctx_data, game)
+
+        sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+        change = {"type": "fix", "target": record_id, "table": game.get("table"),
+                  "uids": [], "names": [], "scores": [], "slots": [], "uma": [], "pt": []}
+        lines = [f"✏️ 已修正对局 #{record_id}"]
+        ICONS = ["🥇", "🥈", "🥉", "💀"]
+        settled = _settle_scores([score for _, score in sorted_scores])
+        for (uid, score), (slot, avg_uma, final_pt) in zip(sorted_scores, settled):
+            user = self._get_player(ctx_data, uid, names[uid])
+            user.record_game(user.name, slot, score, final_pt)
+            for field, value in zip(("uids", "names", "scores", "slots", "uma", "pt"),
+                                    (uid, names[uid], score, slot, avg_uma, final_pt)):
+                change[field].append(value)
+            pt_str = f"+{final_pt}" if final_pt > 0 else f"{final_pt}"
+            lines.append(f"{ICONS[slot]} {names[uid]}: {score} ({pt_str}pt)")
+
+        if stale:
+            self._refresh_max_scores(ctx_data, records + [{"id": None, **change}], stale)
+        self._record_change(ctx_id, "fix", change["uids"], change)
+        yield event.plain_result("\n".join(lines))
+
+    @command("mj_rebuild", alias=["重算数据"])
+    @_group_serialized
+    async def rebuild_stats(self, event: AstrMessageEvent):
+        """
+        [管理员] 根据本赛季的对局记录重新计算本群全部选手的数据
+        用于调整计分规则后或数据损坏时修复累计数据；对局记录本身不变
+        """
+        ctx_id = self._get_context_id(event)
+        started = time.perf_counter()
+        records = await self._load_season_records(ctx_id)
+        if not records:
+            yield event.plain_result("⚠️ 本赛季还没有对局记录，无需重算。")
+            return
+
+        # 对局记录覆盖不到的累计数据 (开始保存记录之前的对局、罚分) 重算后会丢失，这种情况不做重算
+        old = self._get_ctx_data(ctx_id)
+        counts = _history_counts(records)
+        uncovered = [
+            user.name for uid, user in old.items()
+            if isinstance(user, PlayerStats) and (
+                user.total_matches > counts.get(uid, 0) or (uid not in counts and user.total_pt != 0)
+            )
+        ]
+        if uncovered:
+            names = "、".join(uncovered[:5]) + (f" 等 {len(uncovered)} 人" if len(uncovered) > 5 else "")
+            yield event.plain_result(
+                f"⚠️ 对局记录不完整，无法重算。\n"
+                f"{names} 的累计数据中有对局记录之外的成绩 (开始保存对局记录之前的对局或罚分)，"
+                f"重算会丢失这部分数据，本次未做任何修改。"
+            )
+            return
+
+        rebuilt = await asyncio.get_running_loop().run_in_executor(None, _replay_records, records)
+
+        changed = sum(
+            1 for uid, user in rebuilt.items()
+            if isinstance(user, PlayerStats) and (uid not in old or old[uid].to_dict() != user.to_dict())
+        )
+        changed += sum(1 for uid, user in old.items() if isinstance(user, PlayerStats) and uid not in rebuilt)
+
+        self.data[ctx_id] = rebuilt
+        self.boards.pop(ctx_id, None)
+        # 时间段榜单与近期状态按当前规则重新结算，规则变了也要跟着重建
+        self._windows.pop(ctx_id, None)
+        self._forms.pop(ctx_id, None)
+        self._versions[ctx_id] = self._versions.get(ctx_id, 0) + 1
+        if self.sql:
+            self.sql.replace_group(ctx_id, rebuilt)
+        else:
+            self._save_data(ctx_id)
+
+        players = sum(1 for user in rebuilt.values() if isinstance(user, PlayerStats))
+        elapsed = (time.perf_counter() - started) * 1000
+        yield event.plain_result(
+            f"♻️ 已根据 {len(records)} 条对局记录重算本群赛季数据\n"
+            f"选手 {players} 人，其中 {changed} 人的数据有变化\n"
+            f"耗时 {elapsed:.0f} ms"
+        )
+
+    async def terminate(self):
+        """插件卸载/停用时把未落盘的数据写完并关闭存储"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        if self._expiry_task is not None:
+            self._expiry_task.cancel()
+        self._flush_dirty()
+        await asyncio.get_running_loop().run_in_executor(None, self._writer.close)
+        if self.sql:
+            self.sql.close()
 
     # =======================================================
     # 🎉 活动专区 (当前为：超级加倍印第安麻将)
@@ -683,25 +2945,22 @@ class MahjongPlugin(Star):
             return {"status": {}, "groups": {}}
         try:
             with open(EVENT_DATA_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
+                data = json.load(f)
         except Exception as e:
             logger.error(f"加载活动数据失败: {e}")
             return {"status": {}, "groups": {}}
+        for ctx_data in data.get("groups", {}).values():
+            for uid, user in ctx_data.items():
+                ctx_data[uid] = EventPlayerStats.from_dict(user)
+        return data
 
-    def _save_event_data(self):
-        try:
-            with open(EVENT_DATA_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.event_data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"保存活动数据失败: {e}")
+    def _save_event_data(self, ctx_id: str):
+        self._event_versions[ctx_id] = self._event_versions.get(ctx_id, 0) + 1
+        self._event_dirty = True
+        self._schedule_flush()
 
     def _get_user_event_match(self, ctx_id: str, user_id: str):
-        if ctx_id not in self.event_matches:
-            return None, None
-        for mid, match in self.event_matches[ctx_id].items():
-            if user_id in match["players"]:
-                return mid, match
-        return None, None
+        return self.event_index.find(ctx_id, user_id)
 
     @command("mj_event_toggle", alias=["event"])
     async def toggle_event(self, event: AstrMessageEvent):
@@ -711,12 +2970,13 @@ class MahjongPlugin(Star):
         
         # 切换状态
         self.event_data["status"][ctx_id] = not current_status
-        self._save_event_data()
+        self._save_event_data(ctx_id)
         
         state_str = "🟢 已开启" if not current_status else "🔴 已关闭"
         yield event.plain_result(f"📢 活动场 {state_str}！")
 
     @command("mj_event_start", alias=["活动对局开始", "活动开始"])
+    @_group_serialized
     async def start_event_match(self, event: AstrMessageEvent):
         """开始一场活动对局"""
         ctx_id = self._get_context_id(event)
@@ -737,16 +2997,17 @@ class MahjongPlugin(Star):
         if ctx_id not in self.event_matches:
             self.event_matches[ctx_id] = {}
             
-        match_id = 1
-        while str(match_id) in self.event_matches[ctx_id]:
-            match_id += 1
-        match_id = str(match_id)
+        match_id = self.event_index.allocate(ctx_id)
 
         self.event_matches[ctx_id][match_id] = {
             "players": {user_id: user_name},
             "scores": {},
-            "status": "recruiting"
+            "status": "recruiting",
+            "origin": event.unified_msg_origin,
         }
+        self.event_index.seat(ctx_id, user_id, match_id)
+        self.event_index.recruit(ctx_id, match_id)
+        self._log_table("event", "create", ctx_id, match_id)
         
         yield event.plain_result(
             f"活动场 #{match_id} 已建立！\n"
@@ -756,6 +3017,7 @@ class MahjongPlugin(Star):
         )
 
     @command("mj_event_join", alias=["活动加入"])
+    @_group_serialized
     async def join_event_match(self, event: AstrMessageEvent, match_id: str = ""):
         """加入活动对局"""
         ctx_id = self._get_context_id(event)
@@ -785,14 +3047,15 @@ class MahjongPlugin(Star):
                 yield event.plain_result(f"⚠️ 找不到活动局 #{match_id}。")
                 return
         else:
-            recruiting_matches = {k: v for k, v in self.event_matches[ctx_id].items() if v["status"] == "recruiting"}
-            if not recruiting_matches:
+            recruiting_mids = self.event_index.recruiting_tables(ctx_id)
+            if not recruiting_mids:
                 yield event.plain_result("QAQ 所有的活动局都已经开始了……")
                 return
-            elif len(recruiting_matches) == 1:
-                target_mid, target_match = list(recruiting_matches.items())[0]
+            elif len(recruiting_mids) == 1:
+                target_mid = recruiting_mids[0]
+                target_match = self.event_matches[ctx_id][target_mid]
             else:
-                yield event.plain_result(f"⚠️ 有多个活动局在招募，请指定桌号，如 /活动加入 {list(recruiting_matches.keys())[0]}")
+                yield event.plain_result(f"⚠️ 有多个活动局在招募，请指定桌号，如 /活动加入 {recruiting_mids[0]}")
                 return
 
         if target_match["status"] != "recruiting":
@@ -803,10 +3066,14 @@ class MahjongPlugin(Star):
             return
 
         target_match["players"][user_id] = user_name
+        self.event_index.seat(ctx_id, user_id, target_mid)
         current_count = len(target_match["players"])
-
         if current_count == 4:
             target_match["status"] = "playing"
+            self.event_index.start(ctx_id, target_mid)
+        self._log_table("event", "join", ctx_id, target_mid)
+
+        if current_count == 4:
             winds = ["东", "南", "西", "北"]
             player_list = list(target_match["players"].values())
             import random
@@ -823,20 +3090,21 @@ class MahjongPlugin(Star):
             yield event.plain_result(f"选手 {user_name} 加入活动局 #{target_mid} ！ ({current_count}/4)")
 
     @command("mj_event_cancel", alias=["活动取消", "活动解散"])
+    @_group_serialized
     async def cancel_event_match(self, event: AstrMessageEvent):
         ctx_id = self._get_context_id(event)
         user_id = event.get_sender_id()
         mid, match = self._get_user_event_match(ctx_id, user_id)
         
         if match:
-            del self.event_matches[ctx_id][mid]
-            if not self.event_matches[ctx_id]:
-                del self.event_matches[ctx_id]
+            self.event_index.remove(ctx_id, mid)
+            self._log_table("event", "cancel", ctx_id, mid)
             yield event.plain_result(f"🚫 已解散活动局 #{mid}。")
         else:
             yield event.plain_result("⚠️ 你当前不在活动局中。")
 
     @command("mj_event_ng", alias=["NG", "ng"])
+    @_group_serialized
     async def record_event_ng(self, event: AstrMessageEvent):
         """记录选手的NG次数"""
         ctx_id = self._get_context_id(event)
@@ -852,20 +3120,17 @@ class MahjongPlugin(Star):
             yield event.plain_result("⚠️ 请 @ 触犯了NG内容的选手。\n示例: /活动ng @某人")
             return
             
-        if target_uid not in ctx_data:
-            ctx_data[target_uid] = {"name": f"用户{target_uid}", "total_pt": 0.0, "total_matches": 0, "total_score": 0, "ng_count": 0}
+        user_data = ctx_data.get(target_uid)
+        if user_data is None:
+            user_data = ctx_data[target_uid] = EventPlayerStats(f"用户{target_uid}")
             
-        user_data = ctx_data[target_uid]
-        # 兼容旧字段
-        if "ng_count" not in user_data:
-            user_data["ng_count"] = 0
-            
-        user_data["ng_count"] += 1
-        self._save_event_data()
+        user_data.ng_count += 1
+        self._save_event_data(ctx_id)
         
-        yield event.plain_result(f"🚨 NG 记录！\n选手 {user_data['name']} NG次数+1 \n当前累计NG次数：{user_data['ng_count']} 次 \n ohno")
+        yield event.plain_result(f"🚨 NG 记录！\n选手 {user_data.name} NG次数+1 \n当前累计NG次数：{user_data.ng_count} 次 \n ohno")
 
     @command("mj_event_end", alias=["活动得点", "活动结束"])
+    @_group_serialized
     async def end_event_match(self, event: AstrMessageEvent, score: int):
         """记录活动局分数（仅素点，总和40w）"""
         ctx_id = self._get_context_id(event)
@@ -881,6 +3146,7 @@ class MahjongPlugin(Star):
 
         match["scores"][user_id] = score
         submitted_count = len(match["scores"])
+        self._log_table("event", "score", ctx_id, mid)
         
         if submitted_count == 4:
             total_score = sum(match["scores"].values())
@@ -908,30 +3174,27 @@ class MahjongPlugin(Star):
                 pt = round((s - 100000) / 1000.0, 1)
                 pt_str = f"+{pt}" if pt > 0 else f"{pt}"
 
-                user_stat = ctx_data.setdefault(uid, {
-                    "name": username, "total_pt": 0.0, "total_matches": 0, "total_score": 0, "ng_count": 0
-                })
-                if "ng_count" not in user_stat: user_stat["ng_count"] = 0
-
-                user_stat["name"] = username
-                user_stat["total_pt"] = round(user_stat["total_pt"] + pt, 1)
-                user_stat["total_matches"] += 1
-                user_stat["total_score"] += s
+                user_stat = ctx_data.get(uid)
+                if user_stat is None:
+                    user_stat = ctx_data[uid] = EventPlayerStats(username)
+                user_stat.record_game(username, s, pt)
 
                 result_msg.append(f"{rank_idx+1}位 {username}: {s} ({pt_str}pt)")
 
-            self._save_event_data()
-            del self.event_matches[ctx_id][mid]
-            if not self.event_matches[ctx_id]:
-                del self.event_matches[ctx_id]
+            self._save_event_data(ctx_id)
+            self.event_index.remove(ctx_id, mid)
+            self._log_table("event", "settle", ctx_id, mid)
             
             yield event.plain_result("\n".join(result_msg))
         else:
             yield event.plain_result(f"💾 活动分数已记录 ({submitted_count}/4)")
 
     @command("mj_event_rank", alias=["活动榜", "活动排行", "活动rank"])
-    async def show_event_rank(self, event: AstrMessageEvent):
-        """展示活动场的三大奖项排行"""
+    async def show_event_rank(self, event: AstrMessageEvent, option: str = ""):
+        """
+        展示活动场的三大奖项排行
+        翻页: /活动榜 2 查看第 2 页，/活动榜 top=5 只看前 5 名
+        """
         ctx_id = self._get_context_id(event)
         ctx_data = self.event_data.get("groups", {}).get(ctx_id, {})
         
@@ -939,31 +3202,40 @@ class MahjongPlugin(Star):
             yield event.plain_result("⚠️ 暂无活动记录。")
             return
 
+        cache_key = (ctx_id, "event_rank", option, self._event_versions.get(ctx_id, 0))
+        text = self._render_cache.get(cache_key)
+        if text is None:
+            text = self._render_event_rank(ctx_data, option)
+            self._render_cache.put(cache_key, text)
+        yield event.plain_result(text)
+
+    def _render_event_rank(self, ctx_data: dict, option: str) -> str:
         users = list(ctx_data.values())
-        if not users:
-            return
 
+        # 只选出当前页需要的前 stop 名，不对全体排序
+        start, stop, page = self._parse_page(option)
         msg = ["🏆 **【超级加倍印第安】活动大赏** 🏆\n"]
 
         # 1. MVP赏 (PT最高)
-        mvp_list = sorted(users, key=lambda x: x["total_pt"], reverse=True)
+        mvp_list = heapq.nlargest(stop, users, key=lambda x: x.total_pt)[start:]
         msg.append("👑 【MVP赏】 (总PT排行)")
-        for i, u in enumerate(mvp_list):
-            msg.append(f"  {i+1}. {u['name']} — {u['total_pt']} pt")
+        for i, u in enumerate(mvp_list, start):
+            msg.append(f"  {i+1}. {u.name} — {u.total_pt} pt")
         msg.append("")
 
         # 2. 手气最佳赏 (平均得点最高)
-        luck_list = sorted(users, key=lambda x: x["total_score"] / x["total_matches"] if x["total_matches"] > 0 else 0, reverse=True)
+        luck_list = heapq.nlargest(stop, users, key=lambda x: x.total_score / x.total_matches if x.total_matches > 0 else 0)[start:]
         msg.append("🍀 【手气最佳赏】 (均点排行)")
-        for i, u in enumerate(luck_list):
-            avg = int(u["total_score"] / u["total_matches"]) if u["total_matches"] > 0 else 0
-            msg.append(f"  {i+1}. {u['name']} — {avg} 点 ({u['total_matches']}场)")
+        for i, u in enumerate(luck_list, start):
+            avg = int(u.total_score / u.total_matches) if u.total_matches > 0 else 0
+            msg.append(f"  {i+1}. {u.name} — {avg} 点 ({u.total_matches}场)")
         msg.append("")
 
         # 3. NG赏 (NG次数最多)
-        ng_list = sorted(users, key=lambda x: x.get("ng_count", 0), reverse=True)
+        ng_list = heapq.nlargest(stop, users, key=lambda x: x.ng_count)[start:]
         msg.append("🚨 【NG赏】 (NG次数排行)")
-        for i, u in enumerate(ng_list):
-            msg.append(f"  {i+1}. {u['name']} — NG {u.get('ng_count', 0)} 次")
+        for i, u in enumerate(ng_list, start):
+            msg.append(f"  {i+1}. {u.name} — NG {u.ng_count} 次")
 
-        yield event.plain_result("\n".join(msg))
+        msg += self._page_footer(page, len(users), "/活动榜")
+        return "\n".join(msg)
@@ -0,0 +1,151 @@
+"""
+并发报分压力测试：多桌同时、重复地 /得点，每桌必须恰好结算一次
+插件只依赖 astrbot.api 的少量接口，这里用最小桩模块代替，不需要安装 AstrBot
+运行: python -m pytest -q tests
+"""
+import asyncio
+import importlib
+import os
+import random
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# ---------------- astrbot.api 桩模块 ----------------
+
+class Context:
+    async def send_message(self, origin, chain):
+        return True
+
+
+class Star:
+    def __init__(self, context):
+        self.context = context
+
+
+class Plain:
+    def __init__(self, text):
+        self.text = text
+
+
+class At:
+    def __init__(self, qq):
+        self.qq = qq
+
+
+class MessageChain:
+    def __init__(self):
+        self.chain = []
+
+    def message(self, text):
+        self.chain.append(text)
+        return self
+
+
+class AstrMessageEvent:
+    def __init__(self, uid, group="g1", text=""):
+        self.user_id = uid
+        self.group_id = group
+        self.message_str = text
+        self.unified_msg_origin = f"test:GroupMessage:{group}"
+
+    def get_sender_id(self):
+        return self.user_id
+
+    def get_sender_name(self):
+        return f"N{self.user_id}"
+
+    def get_self_id(self):
+        return "bot"
+
+    def get_messages(self):
+        return [Plain(self.message_str)]
+
+    def plain_result(self, text):
+        return text
+
+
+def _install_stub():
+    modules = {
+        "astrbot": {},
+        "astrbot.api": {"AstrBotConfig": dict},
+        "astrbot.api.all": {
+            "Context": Context, "Star": Star, "Plain": Plain, "AstrMessageEvent": AstrMessageEvent,
+            "register": lambda *args, **kwargs: (lambda cls: cls),
+        },
+        "astrbot.api.event": {"MessageChain": MessageChain},
+        "astrbot.api.event.filter": {"command": lambda name, alias=None, **kwargs: (lambda f: f)},
+        "astrbot.api.message_components": {"At": At},
+    }
+    for name, attrs in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+
+
+def _load_plugin(tmp_path, monkeypatch):
+    # 插件用相对路径存数据，先切到临时目录再导入
+    monkeypatch.chdir(tmp_path)
+    _install_stub()
+    sys.modules.pop("main", None)
+    return importlib.import_module("main")
+
+
+async def _drain(gen):
+    """模拟框架逐条发送消息：每发一条都让出事件循环，让别的提交插进来"""
+    out = []
+    async for item in gen:
+        out.append(item)
+        await asyncio.sleep(random.random() * 0.002)
+    return out
+
+
+# ---------------- 测试 ----------------
+
+def test_concurrent_duplicate_scores_settle_each_table_once(tmp_path, monkeypatch):
+    main = _load_plugin(tmp_path, monkeypatch)
+    random.seed(15)
+    tables = 40
+
+    async def scenario():
+        plugin = main.MahjongPlugin(Context(), {})
+        seats = {}
+        for t in range(tables):
+            players = [f"t{t}p{i}" for i in range(4)]
+            await _drain(plugin.start_match(AstrMessageEvent(players[0])))
+            for uid in players[1:]:
+                await _drain(plugin.join_match(AstrMessageEvent(uid)))
+            seats[t] = players
+        assert len(plugin.active_matches["group_g1"]) == tables
+
+        # 每桌四人报分，再加上两条重复提交，全部打乱后同时发出
+        submissions = []
+        for t, players in seats.items():
+            scores = [40000, 30000, 20000, 10000]
+            subs = list(zip(players, scores))
+            subs += random.sample(subs, 2)
+            submissions += [(t, uid, score) for uid, score in subs]
+        random.shuffle(submissions)
+        results = await asyncio.gather(
+            *(_drain(plugin.end_match(AstrMessageEvent(uid), str(score))) for _, uid, score in submissions),
+            return_exceptions=True,
+        )
+
+        errors = [r for r in results if isinstance(r, Exception)]
+        settled = {t: 0 for t in seats}
+        for (t, _, _), out in zip(submissions, results):
+            settled[t] += sum(1 for text in out if text.startswith("🀄️ 对局结束"))
+        ctx_data = plugin._get_ctx_data("group_g1")
+        matches = {uid: ctx_data[uid].total_matches for players in seats.values() for uid in players}
+        leftover = plugin.active_matches.get("group_g1", {})
+        await plugin.terminate()
+        return errors, settled, matches, leftover
+
+    errors, settled, matches, leftover = asyncio.run(scenario())
+    assert errors == []
+    assert set(settled.values()) == {1}
+    assert set(matches.values()) == {1}
+    assert not leftover